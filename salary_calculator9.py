@@ -1,10 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 import sqlite3
-from datetime import datetime
+from datetime import datetime, date
 import os
 from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
+from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -16,6 +16,1883 @@ from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email import encoders
 from tkcalendar import Calendar  # Установите: pip install tkcalendar
+import re
+import ast
+import time
+import calendar
+from functools import lru_cache
+from collections import OrderedDict
+from array import array
+import json
+import hashlib
+import hmac
+import gzip
+import uuid
+import html
+import tempfile
+import webbrowser
+from string import Template
+import asyncio
+import argparse
+import ipaddress
+import threading
+from urllib.parse import urlsplit, parse_qs, quote
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Путь к базе можно переопределить переменной окружения (нужно для сервера и нескольких рабочих мест)
+DB_PATH = os.environ.get("RASCHETNIK_DB", "employees.db")
+
+# Начисления и вычеты задаются правилами: файл payroll_rules.json (или путь из RASCHETNIK_RULES).
+# Если файла нет, действуют правила по умолчанию - шесть полей расчётки.
+RULES_PATH = os.environ.get("RASCHETNIK_RULES", "payroll_rules.json")
+DEFAULT_RULES = {
+    "components": [
+        {"key": "base_salary", "label": "Окладная ставка", "kind": "accrual"},
+        {"key": "fixed_bonus", "label": "Фиксированная премия", "kind": "accrual"},
+        {"key": "feoktistov_bonus", "label": "Премия от Феоктистова", "kind": "accrual"},
+        {"key": "overtime", "label": "Сверхурочные", "kind": "accrual"},
+        {"key": "deduction_defect", "label": "Вычет за недостачу и пересорт", "kind": "deduction"},
+        {"key": "deduction_absent", "label": "Вычет за дни Б/С", "kind": "deduction"},
+    ],
+}
+
+# Поля, для которых в salary_archive есть отдельные колонки; заполняются для совместимости
+LEGACY_FIELDS = ("base_salary", "fixed_bonus", "feoktistov_bonus", "overtime", "deduction_defect", "deduction_absent")
+
+EMPLOYEE_COLUMNS = ("id", "fio", "position", "email", "warehouse", "salary")
+SYNC_TABLES = ("employees", "salary_archive")
+ARCHIVE_COLUMNS = ("id", "employee_id", "fio", "position", "warehouse", "base_salary", "fixed_bonus",
+                   "feoktistov_bonus", "overtime", "deduction_defect", "deduction_absent", "total",
+                   "calc_date", "pdf_path", "period")
+
+
+def connect_db(path=None):
+    # timeout/busy_timeout: при одновременной записи из нескольких мест ждём, а не падаем с "database is locked"
+    conn = sqlite3.connect(path or DB_PATH, timeout=30)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    return conn
+
+
+class CachedResult:
+    # Повторяет ту часть интерфейса курсора, которой пользуются функции чтения
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class QueryCache:
+    # Кэш результатов SELECT по ключу (SQL, параметры). Передаётся в функции чтения вместо соединения.
+    # PRAGMA data_version меняется, когда любое другое соединение (в том числе из другого процесса)
+    # фиксирует запись, поэтому проверка актуальности стоит одного лёгкого запроса.
+    def __init__(self, db_path=None, max_entries=64, max_rows=50000):
+        self.conn = connect_db(db_path)
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def current_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def execute(self, sql, params=()):
+        if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            raise ValueError("QueryCache выполняет только запросы на чтение")
+        version = self.current_version()
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        key = (sql, tuple(params))
+        rows = self.entries.get(key)
+        if rows is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return CachedResult(rows)
+        self.misses += 1
+        rows = tuple(self.conn.execute(sql, params).fetchall())
+        if len(rows) <= self.max_rows:
+            self.entries[key] = rows
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return CachedResult(rows)
+
+    def close(self):
+        self.entries.clear()
+        self.conn.close()
+
+
+def init_schema(conn):
+    # WAL позволяет читателям работать параллельно с записью (режим сохраняется в самом файле БД)
+    conn.execute("PRAGMA journal_mode = WAL")
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fio TEXT NOT NULL,
+            position TEXT,
+            email TEXT,
+            warehouse TEXT,
+            salary REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS salary_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id INTEGER,
+            fio TEXT,
+            position TEXT,
+            warehouse TEXT,
+            base_salary REAL,
+            fixed_bonus REAL,
+            feoktistov_bonus REAL,
+            overtime REAL,
+            deduction_defect REAL,
+            deduction_absent REAL,
+            total REAL,
+            calc_date TEXT,
+            pdf_path TEXT,
+            FOREIGN KEY (employee_id) REFERENCES employees (id)
+        )
+    ''')
+    # Прикладывать ли PDF к письму с расчёткой (HTML-версия в теле письма уходит всегда)
+    employee_columns = [row[1] for row in cursor.execute("PRAGMA table_info(employees)")]
+    if "email_pdf" not in employee_columns:
+        cursor.execute("ALTER TABLE employees ADD COLUMN email_pdf INTEGER NOT NULL DEFAULT 1")
+    # Месяц расчёта в сортируемом виде ГГГГ-ММ: по нему строятся годовые справки и выборки за период
+    archive_columns = [row[1] for row in cursor.execute("PRAGMA table_info(salary_archive)")]
+    if "period" not in archive_columns:
+        cursor.execute("ALTER TABLE salary_archive ADD COLUMN period TEXT")
+        conn.create_function("calc_date_period", 1, calc_date_period)
+        cursor.execute("UPDATE salary_archive SET period = calc_date_period(calc_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_salary_archive_employee_period "
+                   "ON salary_archive (employee_id, period)")
+    # Значения компонентов расчёта в общем виде: новый компонент из правил не требует новых колонок.
+    # Подпись и знак сохраняются вместе с суммой, чтобы старые записи читались после смены правил.
+    has_components = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                    "AND name = 'salary_archive_component'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS salary_archive_component (
+            archive_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            label TEXT NOT NULL,
+            sign INTEGER NOT NULL,
+            sort_order INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (archive_id, key),
+            FOREIGN KEY (archive_id) REFERENCES salary_archive (id)
+        ) WITHOUT ROWID
+    ''')
+    if not has_components:
+        # Перенос существующих записей архива из отдельных колонок
+        for order, component in enumerate(DEFAULT_RULES["components"]):
+            key = component["key"]
+            cursor.execute(f'''
+                INSERT INTO salary_archive_component (archive_id, key, label, sign, sort_order, amount)
+                SELECT id, ?, ?, ?, ?, COALESCE({key}, 0) FROM salary_archive
+            ''', (key, component["label"], 1 if component["kind"] == "accrual" else -1, order))
+    # Табель: одна строка на сотрудника и месяц, бит (день - 1) в absent_mask = день Б/С
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timesheet (
+            employee_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            absent_mask INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (employee_id, period)
+        ) WITHOUT ROWID
+    ''')
+    # Пакетный расчёт за месяц: параметры запуска и состояние каждого сотрудника по шагам
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payroll_run (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period TEXT NOT NULL,
+            calc_date TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+    ''')
+    run_columns = [row[1] for row in cursor.execute("PRAGMA table_info(payroll_run)")]
+    if "lease_owner" not in run_columns:
+        cursor.execute("ALTER TABLE payroll_run ADD COLUMN lease_owner TEXT")
+        cursor.execute("ALTER TABLE payroll_run ADD COLUMN lease_expires REAL")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payroll_run_item (
+            run_id INTEGER NOT NULL,
+            employee_id INTEGER NOT NULL,
+            mail INTEGER NOT NULL DEFAULT 0,
+            step TEXT NOT NULL DEFAULT 'pending',
+            salary_values TEXT,
+            total REAL,
+            pdf_path TEXT,
+            archive_id INTEGER,
+            error TEXT,
+            PRIMARY KEY (run_id, employee_id),
+            FOREIGN KEY (run_id) REFERENCES payroll_run (id)
+        )
+    ''')
+    # Результат последней проверки PDF архива; первый увиденный хэш файла считается эталонным
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_pdf_check (
+            archive_id INTEGER PRIMARY KEY,
+            pdf_path TEXT,
+            sha256 TEXT,
+            status TEXT NOT NULL,
+            checked_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    init_change_journal(cursor)
+    conn.commit()
+
+
+def init_change_journal(cursor):
+    # Журнал изменений для обмена между офисами. Каждая копия базы - узел со своим node_id,
+    # строки сотрудников и архива получают сквозной uid "узел:id", потому что id в разных офисах расходятся.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('node_id', ?)", (uuid.uuid4().hex,))
+    # Последний принятый номер изменения от каждого узла-источника
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_peer (
+            node_id TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            uid TEXT,
+            op TEXT NOT NULL,
+            origin TEXT
+        )
+    ''')
+    for table in SYNC_TABLES:
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if "uid" not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN uid TEXT")
+            cursor.execute(f"UPDATE {table} SET uid = (SELECT value FROM sync_state WHERE key = 'node_id') "
+                           f"|| ':' || id")
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_uid ON {table} (uid)")
+        # uid новой строке присваивает триггер: журнал ведётся для любой записи в таблицу,
+        # а импорт, передающий готовый uid, его сохраняет
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_journal_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE {table} SET uid = (SELECT value FROM sync_state WHERE key = 'node_id') || ':' || NEW.id
+                WHERE id = NEW.id AND NEW.uid IS NULL;
+                INSERT INTO change_log (tbl, row_id, uid, op)
+                VALUES ('{table}', NEW.id, (SELECT uid FROM {table} WHERE id = NEW.id), 'I');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_journal_update AFTER UPDATE ON {table} WHEN OLD.uid IS NOT NULL
+            BEGIN
+                INSERT INTO change_log (tbl, row_id, uid, op) VALUES ('{table}', NEW.id, NEW.uid, 'U');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_journal_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO change_log (tbl, row_id, uid, op) VALUES ('{table}', OLD.id, OLD.uid, 'D');
+            END
+        ''')
+    # Строки, появившиеся до журнала, один раз заносятся в него как вставки, иначе их нельзя выгрузить.
+    # Сотрудники идут раньше архива, чтобы при загрузке записи архива находили своего сотрудника.
+    if cursor.execute("SELECT 1 FROM sync_state WHERE key = 'journal_seeded'").fetchone() is None:
+        for table in SYNC_TABLES:
+            cursor.execute(f'''
+                INSERT INTO change_log (tbl, row_id, uid, op)
+                SELECT '{table}', t.id, t.uid, 'I' FROM {table} t
+                WHERE NOT EXISTS (SELECT 1 FROM change_log c WHERE c.tbl = '{table}' AND c.uid = t.uid)
+                ORDER BY t.id
+            ''')
+        cursor.execute("INSERT INTO sync_state (key, value) VALUES ('journal_seeded', '1')")
+
+
+class PayrollRulesError(ValueError):
+    pass
+
+
+class PayrollPlan:
+    # Правила расчёта, проверенные и скомпилированные один раз в функцию на Python.
+    # Компонент без формулы вводится вручную; формула - арифметическое выражение над другими
+    # компонентами, окладом из справочника (salary), суммами accruals / deductions и функциями min/max/round/abs.
+    FUNCTIONS = {"min": min, "max": max, "round": round, "abs": abs}
+    SPECIAL = ("salary", "accruals", "deductions")
+    ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call,
+                     ast.Constant, ast.Name, ast.Load, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv,
+                     ast.Mod, ast.Pow, ast.USub, ast.UAdd, ast.And, ast.Or, ast.Not, ast.Gt, ast.GtE, ast.Lt,
+                     ast.LtE, ast.Eq, ast.NotEq)
+
+    def __init__(self, rules):
+        components = rules.get("components") if isinstance(rules, dict) else None
+        if not isinstance(components, list) or not components:
+            raise PayrollRulesError("В правилах нет списка components")
+
+        self.components = []  # (key, label, sign, formula)
+        formulas = {}
+        for number, component in enumerate(components, 1):
+            key = component.get("key") if isinstance(component, dict) else None
+            if not isinstance(key, str) or not re.match(r"^[a-z][a-z0-9_]*$", key):
+                raise PayrollRulesError(f"Компонент №{number}: ключ должен состоять из латиницы, цифр и _")
+            if key in self.SPECIAL or key in self.FUNCTIONS or key == "total" or key in formulas:
+                raise PayrollRulesError(f"Компонент {key}: ключ занят или повторяется")
+            kind = component.get("kind", "accrual")
+            if kind not in ("accrual", "deduction"):
+                raise PayrollRulesError(f"Компонент {key}: kind должен быть accrual или deduction")
+            formulas[key] = self._parse(key, component.get("formula"))
+            self.components.append((key, str(component.get("label") or key), 1 if kind == "accrual" else -1,
+                                    component.get("formula")))
+        total_formula = self._parse("total", rules.get("total"))
+
+        self.keys = tuple(key for key, _, _, _ in self.components)
+        self.inputs = tuple(key for key, _, _, formula in self.components if not formula)
+        self.labels = {key: label for key, label, _, _ in self.components}
+        self.signs = {key: sign for key, _, sign, _ in self.components}
+        # Без формул итог - сумма компонентов со знаком (линейная функция введённых значений)
+        self.linear = total_formula is None and all(not formula for _, _, _, formula in self.components)
+        self.source = self._generate(formulas, total_formula)
+        # Встроенные функции недоступны; формулам - только разрешённые, сгенерированному коду - ещё float
+        namespace = {"__builtins__": {}, "float": float}
+        namespace.update(self.FUNCTIONS)
+        exec(compile(self.source, RULES_PATH, "exec"), namespace)
+        self._evaluate_batch = namespace["evaluate_batch"]
+
+    def _parse(self, key, formula):
+        if formula in (None, ""):
+            return None
+        if not isinstance(formula, str):
+            raise PayrollRulesError(f"{key}: формула должна быть строкой")
+        try:
+            tree = ast.parse(formula, mode="eval")
+        except SyntaxError as e:
+            raise PayrollRulesError(f"{key}: ошибка в формуле: {e.msg}")
+        for node in ast.walk(tree):
+            if not isinstance(node, self.ALLOWED_NODES):
+                raise PayrollRulesError(f"{key}: в формуле недопустима конструкция {type(node).__name__}")
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name)
+                                                   and node.func.id in self.FUNCTIONS and not node.keywords):
+                raise PayrollRulesError(f"{key}: из функций доступны только {', '.join(self.FUNCTIONS)}")
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise PayrollRulesError(f"{key}: в формуле допустимы только числа")
+        return tree
+
+    def _names(self, tree):
+        return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id not in self.FUNCTIONS}
+
+    def _generate(self, formulas, total_formula):
+        # Зависимости: компонент -> имена из его формулы; accruals/deductions зависят от всех своих компонентов
+        depends = {key: self._names(tree) if tree else set() for key, tree in formulas.items()}
+        depends["accruals"] = {key for key, _, sign, _ in self.components if sign > 0}
+        depends["deductions"] = {key for key, _, sign, _ in self.components if sign < 0}
+        for key, names in depends.items():
+            unknown = names - set(depends) - {"salary"}
+            if unknown:
+                raise PayrollRulesError(f"{key}: неизвестные имена в формуле: {', '.join(sorted(unknown))}")
+        if total_formula is not None:
+            unknown = self._names(total_formula) - set(depends) - {"salary"}
+            if unknown:
+                raise PayrollRulesError(f"total: неизвестные имена в формуле: {', '.join(sorted(unknown))}")
+
+        # Топологическая сортировка с поиском циклов
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done" or name == "salary":
+                return
+            if state.get(name) == "active":
+                raise PayrollRulesError("Циклическая зависимость: " + " -> ".join(path + [name]))
+            state[name] = "active"
+            for dependency in sorted(depends[name]):
+                visit(dependency, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in list(self.keys) + ["accruals", "deductions"]:
+            visit(name, [])
+
+        def variable(name):
+            return "v_" + name
+
+        class Rename(ast.NodeTransformer):
+            def visit_Name(self, node):
+                if node.id in PayrollPlan.FUNCTIONS:
+                    return node
+                return ast.copy_location(ast.Name(id=variable(node.id), ctx=node.ctx), node)
+
+        def expression(tree):
+            return ast.unparse(Rename().visit(tree).body)
+
+        lines = ["def evaluate_batch(rows):",
+                 "    result = []",
+                 "    append = result.append",
+                 "    for values, v_salary in rows:",
+                 "        get = values.get",
+                 "        v_salary = float(v_salary or 0)"]
+        for name in order:
+            if name in ("accruals", "deductions"):
+                parts = [variable(key) for key in sorted(depends[name], key=self.keys.index)]
+                lines.append(f"        {variable(name)} = {' + '.join(parts) if parts else '0.0'}")
+            elif formulas[name] is None:
+                lines.append(f"        {variable(name)} = float(get({name!r}) or 0)")
+            else:
+                lines.append(f"        {variable(name)} = float({expression(formulas[name])})")
+        total = expression(total_formula) if total_formula is not None else "v_accruals - v_deductions"
+        lines.append(f"        append(({''.join(variable(key) + ', ' for key in self.keys)}float({total})))")
+        lines.append("    return result")
+        return "\n".join(lines) + "\n"
+
+    def evaluate_batch(self, rows):
+        # rows: последовательность пар (введённые значения, оклад из справочника)
+        names = self.keys + ("total",)
+        return [dict(zip(names, amounts)) for amounts in self._evaluate_batch(rows)]
+
+    def evaluate(self, values, salary=0.0):
+        return self.evaluate_batch([(values, salary)])[0]
+
+    def lines(self, values):
+        # (подпись, знак, сумма) для расчётки
+        return [(label, sign, float(values.get(key) or 0)) for key, label, sign, _ in self.components]
+
+
+_payroll_plan = None
+
+
+def load_payroll_plan(path=None):
+    path = path or RULES_PATH
+    if not os.path.exists(path):
+        return PayrollPlan(DEFAULT_RULES)
+    with open(path, encoding="utf-8") as f:
+        try:
+            rules = json.load(f)
+        except ValueError as e:
+            raise PayrollRulesError(f"{path}: некорректный JSON: {e}")
+    return PayrollPlan(rules)
+
+
+def get_payroll_plan():
+    global _payroll_plan
+    if _payroll_plan is None:
+        _payroll_plan = load_payroll_plan()
+    return _payroll_plan
+
+
+def reload_payroll_plan():
+    global _payroll_plan
+    _payroll_plan = load_payroll_plan()
+    return _payroll_plan
+
+
+def use_default_payroll_plan():
+    global _payroll_plan
+    _payroll_plan = PayrollPlan(DEFAULT_RULES)
+    return _payroll_plan
+
+
+def fetch_employees(conn, order_by_fio=False):
+    sql = "SELECT id, fio, position, email, warehouse, salary FROM employees"
+    if order_by_fio:
+        sql += " ORDER BY fio"
+    return conn.execute(sql).fetchall()
+
+
+def fetch_employee(conn, emp_id):
+    return conn.execute("SELECT id, fio, position, email, warehouse, salary FROM employees WHERE id = ?",
+                        (emp_id,)).fetchone()
+
+
+def insert_employee(conn, fio, position, email, warehouse, salary):
+    cursor = conn.execute("INSERT INTO employees (fio, position, email, warehouse, salary) VALUES (?, ?, ?, ?, ?)",
+                          (fio, position, email, warehouse, salary))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def update_employee(conn, emp_id, fio, position, email, warehouse, salary):
+    cursor = conn.execute('''
+        UPDATE employees SET fio=?, position=?, email=?, warehouse=?, salary=? WHERE id=?
+    ''', (fio, position, email, warehouse, salary, emp_id))
+    conn.commit()
+    return cursor.rowcount
+
+
+def employee_wants_pdf(conn, emp_id):
+    row = conn.execute("SELECT email_pdf FROM employees WHERE id = ?", (emp_id,)).fetchone()
+    return bool(row[0]) if row else True
+
+
+def set_employee_email_pdf(conn, emp_id, email_pdf):
+    cursor = conn.execute("UPDATE employees SET email_pdf = ? WHERE id = ?", (int(bool(email_pdf)), emp_id))
+    conn.commit()
+    return cursor.rowcount
+
+
+def delete_employee_row(conn, emp_id):
+    cursor = conn.execute("DELETE FROM employees WHERE id = ?", (emp_id,))
+    conn.execute("DELETE FROM timesheet WHERE employee_id = ?", (emp_id,))
+    conn.commit()
+    return cursor.rowcount
+
+
+def fetch_archive(conn, employee_id=None, warehouse=None, limit=None):
+    sql = '''
+        SELECT sa.id, sa.fio, sa.position, sa.warehouse, sa.total, sa.calc_date, sa.pdf_path
+        FROM salary_archive sa
+    '''
+    where, params = [], []
+    if employee_id is not None:
+        where.append("sa.employee_id = ?")
+        params.append(employee_id)
+    if warehouse is not None:
+        where.append("sa.warehouse = ?")
+        params.append(warehouse)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY sa.calc_date DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return conn.execute(sql, params).fetchall()
+
+
+def fetch_archive_record(conn, record_id):
+    return conn.execute("SELECT " + ", ".join(ARCHIVE_COLUMNS) + " FROM salary_archive WHERE id = ?",
+                        (record_id,)).fetchone()
+
+
+def insert_archive_record(conn, emp_id, fio, position, warehouse, values, total, calc_date, pdf_path, commit=True,
+                          period=None):
+    # period - расчётный месяц ГГГГ-ММ; если не задан, берётся из даты расчёта
+    cursor = conn.execute('''
+        INSERT INTO salary_archive (employee_id, fio, position, warehouse, base_salary, fixed_bonus, feoktistov_bonus, 
+        overtime, deduction_defect, deduction_absent, total, calc_date, pdf_path, period)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (emp_id, fio, position, warehouse) + tuple(float(values.get(f) or 0) for f in LEGACY_FIELDS)
+        + (total, calc_date, pdf_path, period or calc_date_period(calc_date)))
+    plan = get_payroll_plan()
+    conn.executemany('''
+        INSERT INTO salary_archive_component (archive_id, key, label, sign, sort_order, amount)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(cursor.lastrowid, key, label, sign, order, float(values.get(key) or 0))
+          for order, (key, label, sign, _) in enumerate(plan.components)])
+    if commit:
+        conn.commit()
+    return cursor.lastrowid
+
+
+def fetch_archive_components(conn, record_id):
+    return conn.execute("SELECT key, label, sign, amount FROM salary_archive_component WHERE archive_id = ? "
+                        "ORDER BY sort_order", (record_id,)).fetchall()
+
+
+def delete_archive_record(conn, record_id):
+    conn.execute("DELETE FROM salary_archive_component WHERE archive_id = ?", (record_id,))
+    conn.execute("DELETE FROM archive_pdf_check WHERE archive_id = ?", (record_id,))
+    cursor = conn.execute("DELETE FROM salary_archive WHERE id = ?", (record_id,))
+    conn.commit()
+    return cursor.rowcount
+
+
+_fonts_registered = False
+
+
+def register_fonts():
+    global _fonts_registered
+    if not _fonts_registered:
+        pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
+        pdfmetrics.registerFont(TTFont('DejaVuBold', 'DejaVuSans-Bold.ttf'))
+        _fonts_registered = True
+
+
+def payslip_filename(fio):
+    return f"Зарплата_{fio.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
+
+
+def build_salary_pdf(filename, fio, position, warehouse, emp_id, calc_date, values, total, lines=None):
+    # lines: (подпись, знак, сумма); по умолчанию - компоненты текущих правил
+    register_fonts()
+
+    doc = SimpleDocTemplate(filename, pagesize=A4,
+                            rightMargin=30, leftMargin=30,
+                            topMargin=30, bottomMargin=30)
+    styles = getSampleStyleSheet()
+    style_normal = ParagraphStyle(
+        'CustomNormal',
+        parent=styles['Normal'],
+        fontName='DejaVu',
+        fontSize=10,
+        leading=14,
+    )
+    style_bold = ParagraphStyle(
+        'CustomBold',
+        parent=styles['Normal'],
+        fontName='DejaVuBold',
+        fontSize=12,
+        leading=16,
+        alignment=1,
+    )
+
+    story = []
+    story.append(Paragraph("📄 РАСЧЁТ ЗАРАБОТНОЙ ПЛАТЫ", style_bold))
+    story.append(Spacer(1, 12))
+
+    data = [
+        ["ФИО:", fio or ""],
+        ["Должность:", position or ""],
+        ["Склад:", warehouse or ""],
+        ["ID сотрудника:", str(emp_id)],
+        ["Дата расчёта:", calc_date or ""],
+    ]
+    table = Table(data, colWidths=[120, 300])
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
+    ]))
+    story.append(table)
+    story.append(Spacer(1, 20))
+
+    salary_data = [["Позиция", "Сумма (руб.)"]]
+    for label, sign, amount in (lines if lines is not None else get_payroll_plan().lines(values)):
+        salary_data.append([label, format_line_amount(sign, amount)])
+    salary_data.append(["", ""])
+    salary_data.append(["**ИТОГО**", f"**{format_money(total)}**"])
+    salary_table = Table(salary_data, colWidths=[300, 120])
+    salary_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightyellow),
+        ('BACKGROUND', (0, -1), (1, -1), colors.lightgreen),
+        ('FONTNAME', (0, -1), (1, -1), 'DejaVuBold'),
+        ('FONTSIZE', (0, -1), (1, -1), 12),
+    ]))
+    story.append(salary_table)
+    story.append(Spacer(1, 20))
+    story.append(Paragraph("С уважением, бухгалтерский отдел", style_normal))
+    story.append(Paragraph("2026, ООО «Стройсистема»", style_normal))
+
+    doc.build(story)
+    return filename
+
+
+# Отправка через SMTP (Gmail)
+SMTP_SERVER = "smtp.gmail.com"
+SMTP_PORT = 587
+SENDER_EMAIL = "your_company_account@gmail.com"   # ← ЗАМЕНИТЕ НА СВОЙ
+SENDER_PASSWORD = "your_app_password"            # ← ЗАМЕНИТЕ НА APP PASSWORD
+
+
+def send_payslip_email(email, fio, html_body, text_body, filename=None):
+    # Письмо: текст и HTML-версия расчётки, PDF прикладывается только если передан файл
+    msg = MIMEMultipart('mixed')
+    msg['From'] = SENDER_EMAIL
+    msg['To'] = email
+    msg['Subject'] = f"📄 Расчёт заработной платы за {datetime.now().strftime('%B %Y')}"
+
+    body = MIMEMultipart('alternative')
+    body.attach(MIMEText(text_body, 'plain', 'utf-8'))
+    body.attach(MIMEText(html_body, 'html', 'utf-8'))
+    msg.attach(body)
+
+    if filename:
+        with open(filename, "rb") as attachment:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(attachment.read())
+            encoders.encode_base64(part)
+            part.add_header(
+                'Content-Disposition',
+                f'attachment; filename= {os.path.basename(filename)}',
+            )
+            msg.attach(part)
+
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+    server.starttls()
+    server.login(SENDER_EMAIL, SENDER_PASSWORD)
+    server.sendmail(SENDER_EMAIL, email, msg.as_string())
+    server.quit()
+
+
+# Лёгкая расчётка в HTML/тексте: для тела письма и быстрого просмотра без ReportLab.
+# Шаблон страницы можно заменить своим файлом (RASCHETNIK_PAYSLIP_TEMPLATE) с теми же $-подстановками.
+PAYSLIP_TEMPLATE_PATH = os.environ.get("RASCHETNIK_PAYSLIP_TEMPLATE", "payslip_template.html")
+PAYSLIP_HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>Расчёт заработной платы - $fio</title>
+<style>
+body { font-family: "DejaVu Sans", Arial, sans-serif; font-size: 14px; margin: 30px; }
+h2 { text-align: center; font-size: 16px; }
+table { border-collapse: collapse; margin-bottom: 20px; }
+td, th { border: 1px solid #999; padding: 4px 8px; text-align: left; }
+table.info th { background: #add8e6; width: 130px; }
+table.salary th, table.salary td.label { background: #ffffe0; width: 320px; }
+table.salary td.amount { text-align: right; width: 130px; }
+table.salary tr.total td { background: #90ee90; font-weight: bold; font-size: 16px; }
+</style>
+</head>
+<body>
+<h2>📄 РАСЧЁТ ЗАРАБОТНОЙ ПЛАТЫ</h2>
+<table class="info">
+<tr><th>ФИО:</th><td>$fio</td></tr>
+<tr><th>Должность:</th><td>$position</td></tr>
+<tr><th>Склад:</th><td>$warehouse</td></tr>
+<tr><th>ID сотрудника:</th><td>$emp_id</td></tr>
+<tr><th>Дата расчёта:</th><td>$calc_date</td></tr>
+</table>
+<table class="salary">
+<tr><th>Позиция</th><th>Сумма (руб.)</th></tr>
+$rows
+<tr class="total"><td>ИТОГО</td><td class="amount">$total</td></tr>
+</table>
+<p>С уважением, бухгалтерский отдел<br>2026, ООО «Стройсистема»</p>
+</body>
+</html>
+"""
+PAYSLIP_HTML_ROW = '<tr><td class="label">$label</td><td class="amount">$amount</td></tr>'
+PAYSLIP_TEXT_TEMPLATE = """Добрый день, $fio!
+
+Расчёт заработной платы от $calc_date
+Должность: $position
+Склад: $warehouse
+
+$rows
+$separator
+$total_line
+
+С уважением,
+Бухгалтерия компании ООО «Стройсистема»
+"""
+
+
+@lru_cache(maxsize=4)
+def _compiled_payslip_templates(path, mtime):
+    # mtime входит в ключ кэша: изменённый файл шаблона подхватывается без перезапуска
+    page = PAYSLIP_HTML_TEMPLATE
+    if path is not None:
+        with open(path, encoding="utf-8") as f:
+            page = f.read()
+    return Template(page), Template(PAYSLIP_HTML_ROW), Template(PAYSLIP_TEXT_TEMPLATE)
+
+
+def payslip_templates():
+    if os.path.exists(PAYSLIP_TEMPLATE_PATH):
+        return _compiled_payslip_templates(PAYSLIP_TEMPLATE_PATH, os.path.getmtime(PAYSLIP_TEMPLATE_PATH))
+    return _compiled_payslip_templates(None, None)
+
+
+def format_money(value):
+    # + 0.0 убирает отрицательный ноль, иначе -0.001 печатается как "-0.00"
+    return f"{round(value, 2) + 0.0:,.2f}".replace(',', ' ')
+
+
+def format_line_amount(sign, amount):
+    # Одно правило знака для PDF, HTML и текста: минус только у ненулевого вычета
+    return ("-" if sign < 0 and round(amount, 2) else "") + format_money(amount)
+
+
+def render_payslip_html(fio, position, warehouse, emp_id, calc_date, lines, total):
+    # lines: (подпись, знак, сумма), как для PDF
+    page, row, _ = payslip_templates()
+    escape = html.escape
+    rows = "\n".join(row.substitute(label=escape(label),
+                                     amount=format_line_amount(sign, amount))
+                     for label, sign, amount in lines)
+    return page.safe_substitute(fio=escape(fio or ""), position=escape(position or ""),
+                                warehouse=escape(warehouse or ""), emp_id=escape(str(emp_id)),
+                                calc_date=escape(calc_date or ""), rows=rows, total=format_money(total))
+
+
+def render_payslip_text(fio, position, warehouse, emp_id, calc_date, lines, total):
+    _, _, text = payslip_templates()
+    width = max([len(label) for label, _, _ in lines] + [5])
+    rows = "\n".join(f"{label.ljust(width)}  {format_line_amount(sign, amount):>14}" for label, sign, amount in lines)
+    return text.substitute(fio=fio or "", position=position or "", warehouse=warehouse or "", calc_date=calc_date or "",
+                           rows=rows, separator="-" * (width + 16),
+                           total_line=f"{'ИТОГО'.ljust(width)}  {format_money(total):>14}")
+
+
+# Резервное копирование: онлайн-копия через backup API SQLite небольшими порциями страниц.
+# Между порциями база свободна, поэтому окно программы и сервис продолжают работать.
+BACKUP_DIR = os.environ.get("RASCHETNIK_BACKUP_DIR", "backups")
+BACKUP_KEEP = 14
+BACKUP_INTERVAL_HOURS = 24
+BACKUP_PAGES_PER_STEP = 256     # 256 страниц по 4 КБ = 1 МБ за шаг
+BACKUP_STEP_PAUSE = 0.005       # пауза между шагами, сек
+BACKUP_MAX_RESTARTS = 5         # без WAL: сколько раз копия может начаться заново из-за записи в базу
+
+
+def check_database_integrity(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in result] == ["ok"]
+
+
+def list_backups(dest_dir=None):
+    dest_dir = dest_dir or BACKUP_DIR
+    if not os.path.isdir(dest_dir):
+        return []
+    # Только плановые копии: копии перед восстановлением (before_restore_*, раньше employees_*_before_restore)
+    # не удаляются ротацией и не считаются при проверке, пора ли делать новую
+    names = [n for n in os.listdir(dest_dir) if re.match(r"^employees_\d{8}_\d{6}\.db$", n)]
+    # Имя содержит метку времени, поэтому сортировка по имени = сортировка по дате
+    return [os.path.join(dest_dir, n) for n in sorted(names, reverse=True)]
+
+
+def rotate_backups(dest_dir=None, keep=BACKUP_KEEP):
+    removed = []
+    for path in list_backups(dest_dir)[keep:]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def backup_database(dest_dir=None, keep=BACKUP_KEEP, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE,
+                    db_path=None, prefix="employees_"):
+    dest_dir = dest_dir or BACKUP_DIR
+    os.makedirs(dest_dir, exist_ok=True)
+    filename = os.path.join(dest_dir, f"{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    part = filename + ".part"
+
+    # progress вызывается после каждого шага копирования, поэтому время шага - промежуток от конца
+    # предыдущего вызова (после паузы) до текущего. Пауза между шагами делается здесь же:
+    # параметр sleep у backup() срабатывает только при занятой базе.
+    # Последний шаг (remaining == 0) - это фиксация файла копии на диске, источник он не держит.
+    step_times = []
+    finalize = [0.0]
+    last = [0.0]
+    restarts = [0, None]
+
+    def progress(status, remaining, total):
+        elapsed = time.perf_counter() - last[0]
+        # Без WAL запись из другого соединения начинает копию заново; при частой записи
+        # пошаговая копия может не закончиться никогда
+        if restarts[1] is not None and remaining > restarts[1]:
+            restarts[0] += 1
+            if restarts[0] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        restarts[1] = remaining
+        if remaining:
+            step_times.append(elapsed)
+            if pause and wal:
+                time.sleep(pause)
+        else:
+            finalize[0] = elapsed
+        last[0] = time.perf_counter()
+
+    src = connect_db(db_path)
+    dst = sqlite3.connect(part)
+    started = time.perf_counter()
+    try:
+        # В WAL держим открытой читающую транзакцию: копия снимается с одного снимка и не начинается
+        # заново после каждой записи из другого соединения, а сами записи при этом не блокируются.
+        # В других режимах журнала такая транзакция мешала бы записи всё время копирования.
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        src.isolation_level = None
+        if wal:
+            src.execute("BEGIN")
+            src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        last[0] = time.perf_counter()
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except BackupRestarted:
+            # Копируем за один шаг: запись подождёт окончания копии (busy_timeout)
+            step_times.clear()
+            last[0] = time.perf_counter()
+            src.backup(dst, progress=progress)
+        if wal:
+            src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+
+    if not check_database_integrity(part):
+        os.remove(part)
+        raise RuntimeError("Резервная копия не прошла проверку целостности")
+    os.replace(part, filename)
+    removed = rotate_backups(dest_dir, keep) if keep is not None else []
+
+    return {
+        "path": filename,
+        "size": os.path.getsize(filename),
+        "steps": len(step_times) + 1,
+        "restarts": restarts[0],
+        "finalize_ms": finalize[0] * 1000,
+        "max_step_ms": max(step_times) * 1000 if step_times else 0.0,
+        "avg_step_ms": sum(step_times) / len(step_times) * 1000 if step_times else 0.0,
+        "seconds": time.perf_counter() - started,
+        "removed": removed,
+    }
+
+
+def restore_database(backup_path, db_path=None, pages=BACKUP_PAGES_PER_STEP):
+    if not check_database_integrity(backup_path):
+        raise RuntimeError("Файл резервной копии повреждён, восстановление отменено")
+    # Перед восстановлением сохраняем текущее состояние, чтобы его можно было вернуть
+    safety = backup_database(db_path=db_path, keep=None, prefix="before_restore_")
+    src = sqlite3.connect(backup_path)
+    dst = connect_db(db_path)
+    try:
+        src.backup(dst, pages=pages)
+        # Журнал изменений откатился вместе с данными, и новые изменения получили бы номера, которые
+        # другие офисы уже приняли и молча пропустят. Поэтому восстановленная база - новый узел обмена.
+        init_schema(dst)
+        reset_sync_node_id(dst)
+    finally:
+        dst.close()
+        src.close()
+    return safety["path"]
+
+
+def backup_is_due(dest_dir=None, interval_hours=BACKUP_INTERVAL_HOURS):
+    backups = list_backups(dest_dir)
+    if not backups:
+        return True
+    return time.time() - os.path.getmtime(backups[0]) >= interval_hours * 3600
+
+# Моделирование "что если": архив за период загружается в колонки один раз, дальше каждый сценарий
+# пересчитывается по суммам складов (правила без формул) или скомпилированными правилами по строкам
+SIMULATION_FIELDS = ("fixed_bonus", "feoktistov_bonus", "overtime")
+
+
+def calc_date_period(calc_date):
+    # "ДД.ММ.ГГГГ" или "ДД.ММ.ГГГГ ЧЧ:ММ" -> "ГГГГ-ММ"; нераспознанная дата -> None
+    value = (calc_date or "").strip()
+    if len(value) < 10 or value[2] != "." or value[5] != ".":
+        return None
+    year, month = value[6:10], value[3:5]
+    if not (year.isdigit() and month.isdigit()):
+        return None
+    return f"{year}-{month}"
+
+
+def months_back(period, months):
+    year, month = int(period[:4]), int(period[5:7])
+    index = year * 12 + month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def load_archive_columns(conn, months=12, today=None):
+    today = today or datetime.now()
+    last_period = today.strftime("%Y-%m")
+    first_period = months_back(last_period, months - 1)
+
+    # Колонки - по компонентам текущих правил (суммы берутся из salary_archive_component),
+    # чтобы при формулах в правилах сценарий можно было пересчитать теми же правилами
+    plan = get_payroll_plan()
+    keys = tuple(dict.fromkeys(LEGACY_FIELDS + plan.keys))
+    columns = {key: array('d') for key in keys}
+    columns["total"] = array('d')
+    columns["salary"] = array('d')
+    warehouse_index = array('l')
+    warehouses = {}
+    cursor = conn.execute('''
+        SELECT sa.id, sa.warehouse, sa.total, sa.base_salary, c.key, c.amount
+        FROM salary_archive sa LEFT JOIN salary_archive_component c ON c.archive_id = sa.id
+        WHERE sa.period BETWEEN ? AND ?
+        ORDER BY sa.id
+    ''', (first_period, last_period))
+    last_id = None
+    for record_id, warehouse, total, base_salary, key, amount in cursor:
+        if record_id != last_id:
+            last_id = record_id
+            warehouse_index.append(warehouses.setdefault(warehouse or "", len(warehouses)))
+            columns["total"].append(total or 0.0)
+            # Оклада из справочника на момент расчёта в архиве нет - формулам с salary подставляется окладная ставка
+            columns["salary"].append(base_salary or 0.0)
+            for field in keys:
+                columns[field].append(0.0)
+        if key in columns:
+            columns[key][-1] = amount or 0.0
+    return {
+        "warehouses": list(warehouses),
+        "warehouse_index": warehouse_index,
+        "columns": columns,
+        "period": (first_period, last_period),
+    }
+
+
+def warehouse_sums(archive_columns):
+    # Один проход по колонкам: количество строк и суммы полей по каждому складу
+    count = len(archive_columns["warehouses"])
+    sums = {name: [0.0] * count for name in ("total",) + SIMULATION_FIELDS}
+    rows = [0] * count
+    index = archive_columns["warehouse_index"]
+    for i in index:
+        rows[i] += 1
+    for name in sums:
+        target = sums[name]
+        for i, value in zip(index, archive_columns["columns"][name]):
+            target[i] += value
+    sums["rows"] = rows
+    return sums
+
+
+def _simulated_inputs(values, amount, factors):
+    values = dict(values)
+    for field, factor in factors.items():
+        if field in values:
+            values[field] *= factor
+    if amount is not None and "fixed_bonus" in values:
+        values["fixed_bonus"] = float(amount)
+    return values
+
+
+def simulate_scenarios(archive_columns, scenarios, plan=None):
+    # scenarios: список словарей с ключами name, fixed_bonus_factor, fixed_bonus_amount (новая фиксированная
+    # премия на одну запись вместо текущей), feoktistov_bonus_factor, overtime_factor.
+    plan = plan or get_payroll_plan()
+    parsed = []
+    for number, scenario in enumerate(scenarios, 1):
+        amount = scenario.get("fixed_bonus_amount")
+        parsed.append((scenario.get("name") or f"Сценарий {number}", None if amount is None else float(amount),
+                       {field: float(scenario.get(f"{field}_factor", 1.0)) for field in SIMULATION_FIELDS}))
+    warehouses = archive_columns["warehouses"]
+    results = {}
+
+    if plan.linear:
+        # Без формул итог - сумма компонентов со знаком, поэтому изменение итога по складу
+        # = сумма изменений полей по этому складу, строки повторно не обходятся
+        sums = warehouse_sums(archive_columns)
+        for name, amount, factors in parsed:
+            by_warehouse = {}
+            for i, warehouse in enumerate(warehouses):
+                if amount is not None:
+                    delta = (amount * sums["rows"][i] - sums["fixed_bonus"][i]) * plan.signs.get("fixed_bonus", 0)
+                else:
+                    delta = (factors["fixed_bonus"] - 1.0) * sums["fixed_bonus"][i] * plan.signs.get("fixed_bonus", 0)
+                for field in ("feoktistov_bonus", "overtime"):
+                    delta += (factors[field] - 1.0) * sums[field][i] * plan.signs.get(field, 0)
+                current = sums["total"][i]
+                by_warehouse[warehouse] = {"rows": sums["rows"][i], "current": current,
+                                           "simulated": current + delta, "delta": delta}
+            results[name] = by_warehouse
+        return results
+
+    # Есть формулы (например, НДФЛ от начислений): каждая запись пересчитывается скомпилированными правилами
+    # до и после изменения, изменение итога записи прибавляется к сохранённому итогу
+    columns = archive_columns["columns"]
+    index = archive_columns["warehouse_index"]
+    inputs = [({key: columns[key][i] for key in plan.inputs}, columns["salary"][i]) for i in range(len(index))]
+    base = [values["total"] for values in plan.evaluate_batch(inputs)]
+    rows = [0] * len(warehouses)
+    current = [0.0] * len(warehouses)
+    for i, total in zip(index, columns["total"]):
+        rows[i] += 1
+        current[i] += total
+    for name, amount, factors in parsed:
+        simulated = plan.evaluate_batch([(_simulated_inputs(values, amount, factors), salary)
+                                         for values, salary in inputs])
+        delta = [0.0] * len(warehouses)
+        for i, before, after in zip(index, base, simulated):
+            delta[i] += after["total"] - before
+        results[name] = {warehouse: {"rows": rows[i], "current": current[i], "simulated": current[i] + delta[i],
+                                     "delta": delta[i]}
+                         for i, warehouse in enumerate(warehouses)}
+    return results
+
+
+# Производственный календарь: выходные и нерабочие праздничные дни (ст. 112 ТК РФ).
+# Переносы выходных, которые ежегодно утверждает Правительство, здесь не учитываются.
+HOLIDAYS = ((1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8),
+            (2, 23), (3, 8), (5, 1), (5, 9), (6, 12), (11, 4))
+
+
+@lru_cache(maxsize=16)
+def working_day_masks(year):
+    # Для каждого месяца года - битовая маска рабочих дней (бит день - 1)
+    masks = []
+    for month in range(1, 13):
+        mask = 0
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            if date(year, month, day).weekday() < 5 and (month, day) not in HOLIDAYS:
+                mask |= 1 << (day - 1)
+        masks.append(mask)
+    return tuple(masks)
+
+
+def days_to_mask(days):
+    mask = 0
+    for day in days:
+        mask |= 1 << (int(day) - 1)
+    return mask
+
+
+def mask_to_days(mask):
+    return [day for day in range(1, 32) if mask >> (day - 1) & 1]
+
+
+def count_days(mask):
+    return bin(mask).count("1")
+
+
+def get_absent_mask(conn, emp_id, period):
+    row = conn.execute("SELECT absent_mask FROM timesheet WHERE employee_id = ? AND period = ?",
+                       (emp_id, period)).fetchone()
+    return row[0] if row else 0
+
+
+def set_absent_mask(conn, emp_id, period, mask):
+    if mask:
+        conn.execute("INSERT OR REPLACE INTO timesheet (employee_id, period, absent_mask) VALUES (?, ?, ?)",
+                     (emp_id, period, mask))
+    else:
+        conn.execute("DELETE FROM timesheet WHERE employee_id = ? AND period = ?", (emp_id, period))
+    conn.commit()
+    return mask
+
+
+def toggle_absent_day(conn, emp_id, day):
+    period = day.strftime("%Y-%m")
+    mask = get_absent_mask(conn, emp_id, period) ^ (1 << (day.day - 1))
+    return set_absent_mask(conn, emp_id, period, mask)
+
+
+def absence_deduction(salary, absent_mask, period):
+    # Вычет = оклад / рабочих дней в месяце * пропущенных рабочих дней; выходные в табеле не учитываются
+    year, month = int(period[:4]), int(period[5:7])
+    working = working_day_masks(year)[month - 1]
+    working_days = count_days(working)
+    absent_days = count_days(absent_mask & working)
+    deduction = round(float(salary or 0) * absent_days / working_days, 2) if working_days else 0.0
+    return absent_days, working_days, deduction
+
+
+def calculate_absence_deductions(conn, period):
+    # Вычеты за дни Б/С сразу по всем сотрудникам, у которых есть отметки в табеле за месяц
+    cursor = conn.execute('''
+        SELECT e.id, e.salary, t.absent_mask
+        FROM timesheet t JOIN employees e ON e.id = t.employee_id
+        WHERE t.period = ?
+    ''', (period,))
+    return {emp_id: absence_deduction(salary, mask, period) for emp_id, salary, mask in cursor}
+
+
+# Пакетный расчёт за месяц. Каждый сотрудник проходит шаги pending -> calculated -> rendered -> archived
+# (-> mailed, если письмо нужно), после каждого шага состояние фиксируется в payroll_run_item.
+# Прерванный запуск продолжается с того шага, на котором остановился, выполненные шаги не повторяются.
+PAYROLL_STEPS = ("pending", "calculated", "rendered", "archived", "mailed", "skipped")
+# Элемент запуска не завершён, пока не дошёл до последнего нужного ему шага или не пропущен
+PAYROLL_ITEM_UNFINISHED = "i.step NOT IN ('skipped', CASE WHEN i.mail THEN 'mailed' ELSE 'archived' END)"
+PAYROLL_LEASE_SECONDS = 120
+
+
+class PayrollRunBusy(RuntimeError):
+    pass
+
+
+class PayrollItemTaken(Exception):
+    pass
+
+
+def create_payroll_run(conn, period, calc_date, params, employee_ids=None):
+    # params: суммы полей, общие для всех (fixed_bonus, feoktistov_bonus, overtime, deduction_defect),
+    # use_timesheet - брать вычет за дни Б/С из табеля, send_email - рассылать расчётки
+    employees = fetch_employees(conn)
+    if employee_ids is not None:
+        wanted = set(employee_ids)
+        employees = [row for row in employees if row[0] in wanted]
+    cursor = conn.execute("INSERT INTO payroll_run (period, calc_date, params, created_at) VALUES (?, ?, ?, ?)",
+                          (period, calc_date, json.dumps(params, ensure_ascii=False),
+                           datetime.now().strftime("%d.%m.%Y %H:%M:%S")))
+    run_id = cursor.lastrowid
+    send_email = bool(params.get("send_email"))
+    conn.executemany("INSERT INTO payroll_run_item (run_id, employee_id, mail) VALUES (?, ?, ?)",
+                     [(run_id, emp_id, int(send_email and bool(email) and "@" in email))
+                      for emp_id, fio, position, email, warehouse, salary in employees])
+    conn.commit()
+    return run_id
+
+
+def period_calc_date(period):
+    # Дата расчёта по умолчанию - последний день расчётного месяца
+    year, month = int(period[:4]), int(period[5:7])
+    return f"{calendar.monthrange(year, month)[1]:02d}.{month:02d}.{year}"
+
+
+def cancel_payroll_run(conn, run_id):
+    # Запуск, который не может завершиться (ошибки у сотрудников не устранить), закрывается вручную.
+    # Уже записанное в архив остаётся; выполняющий его обработчик остановится перед следующим сотрудником.
+    cursor = conn.execute("UPDATE payroll_run SET status = 'cancelled', finished_at = ? "
+                          "WHERE id = ? AND status = 'running'", (datetime.now().strftime("%d.%m.%Y %H:%M:%S"), run_id))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def find_unfinished_payroll_run(conn):
+    row = conn.execute("SELECT id FROM payroll_run WHERE status = 'running' ORDER BY id DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def payroll_run_summary(conn, run_id):
+    run = conn.execute("SELECT period, calc_date, params, status, created_at, finished_at, lease_expires "
+                       "FROM payroll_run WHERE id = ?", (run_id,)).fetchone()
+    if run is None:
+        return None
+    steps = dict(conn.execute("SELECT step, count(*) FROM payroll_run_item WHERE run_id = ? GROUP BY step",
+                              (run_id,)).fetchall())
+    errors = conn.execute("SELECT employee_id, step, error FROM payroll_run_item "
+                          "WHERE run_id = ? AND error IS NOT NULL ORDER BY employee_id", (run_id,)).fetchall()
+    period, calc_date, params, status, created_at, finished_at, lease_expires = run
+    return {"id": run_id, "period": period, "calc_date": calc_date, "params": json.loads(params),
+            "status": status, "created_at": created_at, "finished_at": finished_at,
+            "leased": lease_expires is not None and lease_expires > time.time(),
+            "steps": {step: steps.get(step, 0) for step in PAYROLL_STEPS},
+            "errors": [{"employee_id": emp_id, "step": step, "error": error} for emp_id, step, error in errors]}
+
+
+def run_payslip_filename(fio, period, run_id):
+    # Имя файла не зависит от времени, поэтому повторная отрисовка перезаписывает тот же файл
+    return f"Зарплата_{fio.replace(' ', '_')}_{period}_запуск{run_id}.pdf"
+
+
+def _advance_run_item(conn, run_id, emp_id, expected, step, commit=True, **fields):
+    # Шаг сдвигается, только если элемент всё ещё на ожидаемом шаге: если его уже продвинул
+    # другой обработчик того же запуска, изменения этой транзакции откатываются
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    cursor = conn.execute(f"UPDATE payroll_run_item SET step = ?, error = NULL{', ' if fields else ''}{assignments} "
+                          "WHERE run_id = ? AND employee_id = ? AND step = ?",
+                          (step, *fields.values(), run_id, emp_id, expected))
+    if cursor.rowcount != 1:
+        raise PayrollItemTaken()
+    if commit:
+        conn.commit()
+    return step
+
+
+def _take_run_lease(conn, run_id, owner):
+    # Аренда запуска: пока она действует, другой процесс или окно тот же запуск не выполняет.
+    # Продлевается после каждого сотрудника, после сбоя истекает сама. Отменённый запуск аренду не получает.
+    now = time.time()
+    cursor = conn.execute('''
+        UPDATE payroll_run SET lease_owner = ?, lease_expires = ?
+        WHERE id = ? AND status = 'running' AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)
+    ''', (owner, now + PAYROLL_LEASE_SECONDS, run_id, owner, now))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def execute_payroll_run(run_id, db_path=None, progress=None, stop=None):
+    conn = connect_db(db_path)
+    owner = uuid.uuid4().hex
+    try:
+        run = conn.execute("SELECT period, calc_date, params, status FROM payroll_run WHERE id = ?",
+                           (run_id,)).fetchone()
+        if run is None:
+            raise ValueError(f"Запуск №{run_id} не найден")
+        period, calc_date, params, status = run
+        if status != "running":
+            # Завершённый или отменённый запуск выполнять нечего
+            return payroll_run_summary(conn, run_id)
+        if not _take_run_lease(conn, run_id, owner):
+            raise PayrollRunBusy(f"Запуск №{run_id} уже выполняется в другом окне или сервисе")
+        params = json.loads(params)
+
+        items = conn.execute(f'''
+            SELECT i.employee_id, i.mail, i.step, i.salary_values, i.total, i.pdf_path,
+                   e.fio, e.position, e.email, e.warehouse, e.salary, e.email_pdf
+            FROM payroll_run_item i LEFT JOIN employees e ON e.id = i.employee_id
+            WHERE i.run_id = ? AND {PAYROLL_ITEM_UNFINISHED}
+            ORDER BY i.employee_id
+        ''', (run_id,)).fetchall()
+        deductions = calculate_absence_deductions(conn, period) if params.get("use_timesheet", True) else {}
+
+        # Исходные данные: общие суммы из параметров запуска, оклад из справочника, вычет Б/С из табеля
+        plan = get_payroll_plan()
+
+        def run_inputs(emp_id, salary):
+            values = {key: params[key] for key in plan.inputs if key in params}
+            values["base_salary"] = float(salary or 0)
+            if emp_id in deductions:
+                values["deduction_absent"] = deductions[emp_id][2]
+            return values, salary
+
+        # Всех ещё не посчитанных сотрудников считаем одним вызовом скомпилированных правил;
+        # если формула падает на ком-то из них, ниже каждый будет посчитан отдельно с записью ошибки
+        pending = [item for item in items if item[2] == "pending" and item[6] is not None]
+        try:
+            calculated = dict(zip([item[0] for item in pending],
+                                  plan.evaluate_batch([run_inputs(item[0], item[10]) for item in pending])))
+        except Exception:
+            calculated = {}
+
+        for number, item in enumerate(items, 1):
+            if stop is not None and stop.is_set():
+                break
+            if not _take_run_lease(conn, run_id, owner):
+                if conn.execute("SELECT status FROM payroll_run WHERE id = ?", (run_id,)).fetchone()[0] != "running":
+                    break
+                raise PayrollRunBusy(f"Запуск №{run_id} продолжен в другом окне или сервисе")
+            emp_id, mail, step, salary_values, total, pdf_path, fio, position, email, warehouse, salary, email_pdf = item
+            try:
+                if fio is None:
+                    # Удалённого сотрудника обработать нельзя: элемент закрывается, чтобы запуск мог завершиться
+                    conn.execute("UPDATE payroll_run_item SET step = 'skipped', error = ? "
+                                 "WHERE run_id = ? AND employee_id = ? AND step = ?",
+                                 ("Сотрудник удалён", run_id, emp_id, step))
+                    conn.commit()
+                    continue
+                if step == "pending":
+                    values = calculated.get(emp_id) or plan.evaluate(*run_inputs(emp_id, salary))
+                    total = values["total"]
+                    salary_values = json.dumps(values)
+                    step = _advance_run_item(conn, run_id, emp_id, step, "calculated", salary_values=salary_values,
+                                             total=total)
+                values = json.loads(salary_values)
+                if step == "calculated":
+                    pdf_path = run_payslip_filename(fio, period, run_id)
+                    build_salary_pdf(pdf_path, fio, position, warehouse, emp_id, calc_date, values, total)
+                    step = _advance_run_item(conn, run_id, emp_id, step, "rendered", pdf_path=pdf_path)
+                if step == "rendered":
+                    # Запись в архив и отметка шага - в одной транзакции, поэтому двойной записи не будет
+                    archive_id = insert_archive_record(conn, emp_id, fio, position, warehouse, values, total,
+                                                       calc_date, pdf_path, commit=False, period=period)
+                    step = _advance_run_item(conn, run_id, emp_id, step, "archived", archive_id=archive_id)
+                if step == "archived" and mail:
+                    # Если программа упадёт между отправкой и отметкой шага, письмо при продолжении уйдёт повторно
+                    lines = plan.lines(values)
+                    send_payslip_email(email, fio,
+                                       render_payslip_html(fio, position, warehouse, emp_id, calc_date, lines, total),
+                                       render_payslip_text(fio, position, warehouse, emp_id, calc_date, lines, total),
+                                       pdf_path if email_pdf else None)
+                    step = _advance_run_item(conn, run_id, emp_id, step, "mailed")
+            except PayrollItemTaken:
+                conn.rollback()
+            except Exception as e:
+                conn.rollback()
+                conn.execute("UPDATE payroll_run_item SET error = ? WHERE run_id = ? AND employee_id = ?",
+                             (str(e), run_id, emp_id))
+                conn.commit()
+            finally:
+                if progress is not None:
+                    progress(number, len(items))
+
+        remaining = conn.execute(f'''
+            SELECT count(*) FROM payroll_run_item i WHERE i.run_id = ? AND {PAYROLL_ITEM_UNFINISHED}
+        ''', (run_id,)).fetchone()[0]
+        if not remaining:
+            conn.execute("UPDATE payroll_run SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'",
+                         (datetime.now().strftime("%d.%m.%Y %H:%M:%S"), run_id))
+        conn.execute("UPDATE payroll_run SET lease_owner = NULL, lease_expires = NULL "
+                     "WHERE id = ? AND lease_owner = ?", (run_id, owner))
+        conn.commit()
+        return payroll_run_summary(conn, run_id)
+    finally:
+        conn.close()
+
+
+# Годовые справки о начислениях: агрегаты по всем сотрудникам одним сгруппированным запросом
+# по индексу (employee_id, period), PDF строятся параллельно в отдельных процессах
+MONTH_NAMES = ("Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+               "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь")
+
+
+def annual_earnings(conn, year):
+    bounds = (f"{year:04d}-01", f"{year:04d}-12")
+    cursor = conn.execute('''
+        SELECT sa.employee_id, sa.period, count(*), MAX(sa.fio), MAX(sa.position), MAX(sa.warehouse),
+               e.fio, e.position, e.warehouse, SUM(sa.total)
+        FROM salary_archive sa LEFT JOIN employees e ON e.id = sa.employee_id
+        WHERE sa.employee_id IS NOT NULL AND sa.period BETWEEN ? AND ?
+        GROUP BY sa.employee_id, sa.period
+        ORDER BY sa.employee_id, sa.period
+    ''', bounds)
+    statements = {}
+    months = {}
+    for row in cursor:
+        emp_id, period, records, total = row[0], row[1], row[2], row[9] or 0.0
+        statement = statements.get(emp_id)
+        if statement is None:
+            # Данные сотрудника - из справочника, для удалённых - из архива
+            statement = statements[emp_id] = {
+                "employee_id": emp_id, "year": year,
+                "fio": row[6] or row[3], "position": row[7] or row[4], "warehouse": row[8] or row[5],
+                "records": 0, "components": [], "months": [], "totals": {"total": 0.0},
+            }
+        statement["records"] += records
+        statement["totals"]["total"] += total
+        month = months[emp_id, period] = {"period": period, "total": total}
+        statement["months"].append(month)
+
+    # Суммы компонентов - в общем виде, поэтому в справку попадают и компоненты, добавленные в правила позже
+    cursor = conn.execute('''
+        SELECT sa.employee_id, sa.period, c.key, MAX(c.label), MAX(c.sign), MIN(c.sort_order), SUM(c.amount)
+        FROM salary_archive sa JOIN salary_archive_component c ON c.archive_id = sa.id
+        WHERE sa.employee_id IS NOT NULL AND sa.period BETWEEN ? AND ?
+        GROUP BY sa.employee_id, sa.period, c.key
+    ''', bounds)
+    orders = {}
+    for emp_id, period, key, label, sign, sort_order, amount in cursor:
+        statement = statements[emp_id]
+        known = orders.setdefault(emp_id, {})
+        if key not in known:
+            known[key] = sort_order
+            statement["components"].append((key, label, sign))
+        months[emp_id, period][key] = amount or 0.0
+        statement["totals"][key] = statement["totals"].get(key, 0.0) + (amount or 0.0)
+    for emp_id, statement in statements.items():
+        statement["components"].sort(key=lambda component: orders[emp_id][component[0]])
+    return list(statements.values())
+
+
+def annual_statement_filename(out_dir, statement):
+    return os.path.join(out_dir, f"Справка_{statement['year']}_{statement['fio'].replace(' ', '_')}"
+                                 f"_{statement['employee_id']}.pdf")
+
+
+def build_annual_statement_pdf(filename, statement):
+    register_fonts()
+
+    doc = SimpleDocTemplate(filename, pagesize=landscape(A4),
+                            rightMargin=30, leftMargin=30,
+                            topMargin=30, bottomMargin=30)
+    styles = getSampleStyleSheet()
+    style_normal = ParagraphStyle(
+        'CustomNormal',
+        parent=styles['Normal'],
+        fontName='DejaVu',
+        fontSize=10,
+        leading=14,
+    )
+    style_bold = ParagraphStyle(
+        'CustomBold',
+        parent=styles['Normal'],
+        fontName='DejaVuBold',
+        fontSize=12,
+        leading=16,
+        alignment=1,
+    )
+
+    story = []
+    story.append(Paragraph(f"СПРАВКА О НАЧИСЛЕНИЯХ ЗА {statement['year']} ГОД", style_bold))
+    story.append(Spacer(1, 12))
+
+    data = [
+        ["ФИО:", statement["fio"]],
+        ["Должность:", statement["position"] or ""],
+        ["Склад:", statement["warehouse"] or ""],
+        ["ID сотрудника:", str(statement["employee_id"])],
+    ]
+    table = Table(data, colWidths=[120, 300])
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
+    ]))
+    story.append(table)
+    story.append(Spacer(1, 20))
+
+    def money(value):
+        return f"{value:,.2f}".replace(',', ' ')
+
+    components = statement["components"]
+    months_data = [["Месяц"] + [label for _, label, _ in components] + ["Итого"]]
+    for month in statement["months"]:
+        months_data.append([MONTH_NAMES[int(month["period"][5:7]) - 1]]
+                           + [money(month.get(key, 0.0)) for key, _, _ in components] + [money(month["total"])])
+    totals = statement["totals"]
+    months_data.append(["ИТОГО за год"] + [money(totals.get(key, 0.0)) for key, _, _ in components]
+                       + [money(totals["total"])])
+    # Ширина страницы без полей - около 780 пт; колонки компонентов делят то, что осталось от месяца и итога
+    column_width = min(88, 610 / max(len(components), 1))
+    months_table = Table(months_data, colWidths=[80] + [column_width] * len(components) + [90], repeatRows=1)
+    months_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightyellow),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgreen),
+        ('FONTNAME', (0, -1), (-1, -1), 'DejaVuBold'),
+    ]))
+    story.append(months_table)
+    story.append(Spacer(1, 20))
+    story.append(Paragraph("С уважением, бухгалтерский отдел", style_normal))
+    story.append(Paragraph("2026, ООО «Стройсистема»", style_normal))
+
+    doc.build(story)
+    return filename
+
+
+def _render_annual_statement(args):
+    filename, statement = args
+    return build_annual_statement_pdf(filename, statement)
+
+
+def generate_annual_statements(year, out_dir, db_path=None, workers=None):
+    conn = connect_db(db_path)
+    try:
+        statements = annual_earnings(conn, year)
+    finally:
+        conn.close()
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(annual_statement_filename(out_dir, statement), statement) for statement in statements]
+    if len(jobs) < 2:
+        return [_render_annual_statement(job) for job in jobs]
+    # ReportLab - чистый Python, поэтому параллелим процессами, а не потоками
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_annual_statement, jobs, chunksize=8))
+
+
+# Обмен изменениями между офисами. Файл изменений содержит итоговое состояние строк, изменённых
+# после заданного номера журнала: несколько правок одной строки сжимаются в одну запись.
+# Строки сопоставляются по uid; при встречных правках одной строки побеждает последний загруженный файл.
+CHANGESET_FORMAT = 1
+SYNC_EMPLOYEE_FIELDS = ("fio", "position", "email", "warehouse", "salary", "email_pdf")
+SYNC_ARCHIVE_FIELDS = ("fio", "position", "warehouse") + LEGACY_FIELDS + ("total", "calc_date", "pdf_path", "period")
+
+
+class ChangesetError(ValueError):
+    pass
+
+
+def sync_node_id(conn):
+    return conn.execute("SELECT value FROM sync_state WHERE key = 'node_id'").fetchone()[0]
+
+
+def reset_sync_node_id(conn):
+    # Для базы, скопированной из другого офиса: прежние записи журнала остаются за старым узлом,
+    # чтобы не уйти обратно к нему как новые изменения
+    old_node = sync_node_id(conn)
+    new_node = uuid.uuid4().hex
+    conn.execute("UPDATE change_log SET origin = ? WHERE origin IS NULL", (old_node,))
+    conn.execute("UPDATE sync_state SET value = ? WHERE key = 'node_id'", (new_node,))
+    conn.commit()
+    return new_node
+
+
+def last_change_seq(conn):
+    return conn.execute("SELECT MAX(seq) FROM change_log").fetchone()[0] or 0
+
+
+def sync_peers(conn):
+    return conn.execute("SELECT node_id, last_seq FROM sync_peer ORDER BY node_id").fetchall()
+
+
+def build_changeset(conn, since=0):
+    node = sync_node_id(conn)
+    until = last_change_seq(conn)
+    # Последняя запись журнала по каждой строке (op и origin берутся из строки с MAX(seq))
+    latest = '''
+        SELECT MAX(seq) AS seq, uid, op, origin FROM change_log
+        WHERE tbl = ? AND seq > ? AND seq <= ? AND uid IS NOT NULL GROUP BY uid
+    '''
+    employees = []
+    for row in conn.execute(f'''
+        SELECT c.seq, c.origin, c.op, c.uid, e.uid, {", ".join("e." + f for f in SYNC_EMPLOYEE_FIELDS)}
+        FROM ({latest}) c LEFT JOIN employees e ON e.uid = c.uid ORDER BY c.seq
+    ''', ("employees", since, until)):
+        seq, origin, op, uid, exists = row[:5]
+        if op == "D" or exists is None:
+            employees.append([seq, origin or node, "D", uid, None])
+        else:
+            employees.append([seq, origin or node, op, uid, list(row[5:])])
+
+    components = {}
+    for uid, key, label, sign, order, amount in conn.execute(f'''
+        SELECT a.uid, k.key, k.label, k.sign, k.sort_order, k.amount
+        FROM ({latest}) c JOIN salary_archive a ON a.uid = c.uid
+        JOIN salary_archive_component k ON k.archive_id = a.id
+        ORDER BY a.uid, k.sort_order
+    ''', ("salary_archive", since, until)):
+        components.setdefault(uid, []).append([key, label, sign, order, amount])
+
+    archive = []
+    for row in conn.execute(f'''
+        SELECT c.seq, c.origin, c.op, c.uid, a.uid, e.uid, {", ".join("a." + f for f in SYNC_ARCHIVE_FIELDS)}
+        FROM ({latest}) c LEFT JOIN salary_archive a ON a.uid = c.uid
+        LEFT JOIN employees e ON e.id = a.employee_id ORDER BY c.seq
+    ''', ("salary_archive", since, until)):
+        seq, origin, op, uid, exists, employee_uid = row[:6]
+        if op == "D" or exists is None:
+            archive.append([seq, origin or node, "D", uid, None])
+        else:
+            archive.append([seq, origin or node, op, uid, [employee_uid] + list(row[6:]) + [components.get(uid, [])]])
+
+    return {"format": CHANGESET_FORMAT, "node": node, "since": since, "until": until,
+            "created_at": datetime.now().strftime("%d.%m.%Y %H:%M"),
+            "employee_fields": list(SYNC_EMPLOYEE_FIELDS),
+            "archive_fields": ["employee_uid"] + list(SYNC_ARCHIVE_FIELDS) + ["components"],
+            "employees": employees, "salary_archive": archive}
+
+
+def changeset_filename(changeset, out_dir="."):
+    return os.path.join(out_dir, f"changes_{changeset['node'][:8]}_{changeset['since'] + 1}-{changeset['until']}.json.gz")
+
+
+def export_changeset(since=0, path=None, db_path=None):
+    conn = connect_db(db_path)
+    try:
+        changeset = build_changeset(conn, since)
+    finally:
+        conn.close()
+    path = path or changeset_filename(changeset)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(changeset, f, ensure_ascii=False, separators=(",", ":"))
+    return {"path": path, "since": changeset["since"], "until": changeset["until"],
+            "employees": len(changeset["employees"]), "salary_archive": len(changeset["salary_archive"])}
+
+
+def _apply_employee_change(conn, op, uid, row):
+    local = conn.execute("SELECT id FROM employees WHERE uid = ?", (uid,)).fetchone()
+    if op == "D":
+        if local:
+            conn.execute("DELETE FROM timesheet WHERE employee_id = ?", (local[0],))
+            conn.execute("DELETE FROM employees WHERE id = ?", local)
+        return
+    if local:
+        conn.execute(f"UPDATE employees SET {', '.join(f + ' = ?' for f in SYNC_EMPLOYEE_FIELDS)} WHERE id = ?",
+                     tuple(row) + local)
+    else:
+        conn.execute(f"INSERT INTO employees (uid, {', '.join(SYNC_EMPLOYEE_FIELDS)}) "
+                     f"VALUES (?{', ?' * len(SYNC_EMPLOYEE_FIELDS)})", (uid,) + tuple(row))
+
+
+def _apply_archive_change(conn, op, uid, row):
+    local = conn.execute("SELECT id FROM salary_archive WHERE uid = ?", (uid,)).fetchone()
+    if local:
+        conn.execute("DELETE FROM salary_archive_component WHERE archive_id = ?", local)
+    if op == "D":
+        if local:
+            conn.execute("DELETE FROM salary_archive WHERE id = ?", local)
+        return
+    employee_uid, values, components = row[0], tuple(row[1:-1]), row[-1]
+    employee = conn.execute("SELECT id FROM employees WHERE uid = ?", (employee_uid,)).fetchone()
+    employee_id = employee[0] if employee else None
+    # employee_uid = None - сотрудник удалён в исходном офисе; незнакомый uid - сотрудник сюда не выгружался
+    unlinked = employee_uid is not None and employee is None
+    if local:
+        archive_id = local[0]
+        conn.execute(f"UPDATE salary_archive SET employee_id = ?, "
+                     f"{', '.join(f + ' = ?' for f in SYNC_ARCHIVE_FIELDS)} WHERE id = ?",
+                     (employee_id,) + values + local)
+    else:
+        archive_id = conn.execute(f"INSERT INTO salary_archive (uid, employee_id, {', '.join(SYNC_ARCHIVE_FIELDS)}) "
+                                  f"VALUES (?, ?{', ?' * len(SYNC_ARCHIVE_FIELDS)})",
+                                  (uid, employee_id) + values).lastrowid
+    conn.executemany('''
+        INSERT INTO salary_archive_component (archive_id, key, label, sign, sort_order, amount)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(archive_id,) + tuple(component) for component in components])
+    return unlinked
+
+
+def apply_changeset(conn, changeset):
+    if changeset.get("format") != CHANGESET_FORMAT:
+        raise ChangesetError("Неизвестный формат файла изменений")
+    node = sync_node_id(conn)
+    source, since, until = changeset["node"], changeset["since"], changeset["until"]
+    if source == node:
+        raise ChangesetError("Файл изменений выгружен из этой же базы. Если база скопирована из другого офиса, "
+                             "присвойте ей новый идентификатор: python salary_calculator9.py --new-node-id")
+
+    # unlinked - записи архива, чей сотрудник в этой базе не найден (сохранены без привязки к сотруднику)
+    summary = {"node": source, "since": since, "until": until, "applied": 0, "skipped": 0, "unlinked": []}
+    with conn:
+        # Блокировка записи берётся сразу: номера журнала, порождённые импортом, не смешиваются с чужими
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT last_seq FROM sync_peer WHERE node_id = ?", (source,)).fetchone()
+        last_seq = row[0] if row else 0
+        if since > last_seq:
+            raise ChangesetError(f"Пропущены изменения узла {source[:8]}: принято до №{last_seq}, "
+                                 f"а файл начинается с №{since + 1}. Запросите выгрузку с номера {last_seq}.")
+        # Сначала сотрудники, затем архив: записи архива ссылаются на сотрудников по uid
+        for table, apply in (("employees", _apply_employee_change), ("salary_archive", _apply_archive_change)):
+            for seq, origin, op, uid, row in changeset[table]:
+                # Уже принятое ранее и собственные изменения, вернувшиеся через другой офис, пропускаются
+                if seq <= last_seq or origin == node:
+                    summary["skipped"] += 1
+                    continue
+                mark = last_change_seq(conn)
+                if apply(conn, op, uid, row):
+                    summary["unlinked"].append(uid)
+                # Записи журнала, порождённые импортом, помечаются исходным узлом
+                conn.execute("UPDATE change_log SET origin = ? WHERE seq > ?", (origin, mark))
+                summary["applied"] += 1
+        if until > last_seq:
+            conn.execute("INSERT OR REPLACE INTO sync_peer (node_id, last_seq) VALUES (?, ?)", (source, until))
+    return summary
+
+
+def import_changeset(path, db_path=None):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            changeset = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ChangesetError(f"Не удалось прочитать файл изменений: {e}")
+    conn = connect_db(db_path)
+    try:
+        return apply_changeset(conn, changeset)
+    finally:
+        conn.close()
+
+
+# Проверка PDF архива: каталоги с расчётками читаются одним os.scandir на каталог,
+# хэши файлов считаются в пуле потоков (hashlib отпускает GIL на больших блоках).
+# Первый увиденный хэш файла запоминается; если файл потом изменился или перестал быть PDF - он повреждён.
+PDF_HASH_CHUNK = 1 << 20
+PDF_STATUS_TEXT = {"missing": "нет файла", "corrupt": "повреждён"}
+
+
+def index_pdf_directories(paths):
+    index = {}
+    for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+        try:
+            with os.scandir(directory) as entries:
+                index[directory] = {entry.name for entry in entries if entry.is_file()}
+        except OSError:
+            index[directory] = set()
+    return index
+
+
+def hash_pdf(path):
+    # Возвращает (sha256, похож ли файл на целый PDF)
+    digest = hashlib.sha256()
+    head, tail = b"", b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(PDF_HASH_CHUNK)
+            if not chunk:
+                break
+            if not head:
+                head = chunk[:1024]
+            digest.update(chunk)
+            tail = (tail + chunk)[-1024:]
+    return digest.hexdigest(), head.startswith(b"%PDF-") and b"%%EOF" in tail
+
+
+def _scan_pdf(path):
+    # Файл мог исчезнуть после чтения каталога или не читаться - это отмечается у записи, а не прерывает проверку
+    try:
+        return hash_pdf(path)
+    except OSError:
+        return None
+
+
+def fetch_pdf_problems(conn):
+    return conn.execute("SELECT archive_id, status FROM archive_pdf_check WHERE status != 'ok'").fetchall()
+
+
+def _record_pdf_check(conn, record_id, pdf_path, sha256, status):
+    conn.execute('''
+        INSERT OR REPLACE INTO archive_pdf_check (archive_id, pdf_path, sha256, status, checked_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (record_id, pdf_path, sha256, status, datetime.now().strftime("%d.%m.%Y %H:%M")))
+
+
+def scan_archive_integrity(db_path=None, workers=None):
+    started = time.perf_counter()
+    conn = connect_db(db_path)
+    try:
+        rows = conn.execute('''
+            SELECT sa.id, sa.pdf_path, c.pdf_path, c.sha256
+            FROM salary_archive sa LEFT JOIN archive_pdf_check c ON c.archive_id = sa.id
+        ''').fetchall()
+        index = index_pdf_directories([row[1] for row in rows if row[1]])
+
+        def exists(path):
+            return os.path.basename(path) in index[os.path.dirname(os.path.abspath(path))]
+
+        # Один файл может относиться к нескольким записям - хэшируется один раз
+        paths = sorted({row[1] for row in rows if row[1] and exists(row[1])})
+        with ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) * 2)) as executor:
+            hashes = dict(zip(paths, executor.map(_scan_pdf, paths)))
+
+        summary = {"checked": len(rows), "ok": 0, "missing": 0, "corrupt": 0}
+        with conn:
+            for record_id, pdf_path, checked_path, known_sha in rows:
+                if not pdf_path or hashes.get(pdf_path) is None:
+                    sha256 = known_sha if checked_path == pdf_path else None
+                    status = "corrupt" if pdf_path and os.path.exists(pdf_path) else "missing"
+                else:
+                    sha256, valid = hashes[pdf_path]
+                    if checked_path == pdf_path and known_sha and known_sha != sha256:
+                        # Запомненный хэш не меняем: файл повреждён относительно исходного
+                        sha256, status = known_sha, "corrupt"
+                    else:
+                        status = "ok" if valid else "corrupt"
+                _record_pdf_check(conn, record_id, pdf_path, sha256, status)
+                summary[status] += 1
+            conn.execute("DELETE FROM archive_pdf_check WHERE archive_id NOT IN (SELECT id FROM salary_archive)")
+    finally:
+        conn.close()
+    summary["files"] = sum(1 for result in hashes.values() if result is not None)
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+
+def _render_archive_pdf(args):
+    filename, fio, position, warehouse, emp_id, calc_date, values, total, lines = args
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    build_salary_pdf(filename, fio, position, warehouse, emp_id, calc_date, values, total, lines)
+    return filename
+
+
+def rerender_archive_pdfs(record_ids, db_path=None, workers=None):
+    # Расчётки восстанавливаются из сохранённых в архиве строк и компонентов, без пересчёта по текущим правилам
+    conn = connect_db(db_path)
+    try:
+        jobs = []
+        for record_id in record_ids:
+            row = fetch_archive_record(conn, record_id)
+            if row is None:
+                continue
+            record = dict(zip(ARCHIVE_COLUMNS, row))
+            components = fetch_archive_components(conn, record_id)
+            values = {key: amount for key, label, sign, amount in components}
+            lines = [(label, sign, amount) for key, label, sign, amount in components]
+            filename = record["pdf_path"] or payslip_filename(record["fio"])
+            jobs.append((record_id, not record["pdf_path"], (filename, record["fio"], record["position"], record["warehouse"],
+                                     record["employee_id"], record["calc_date"], values, record["total"], lines)))
+        if len(jobs) < 2:
+            files = [_render_archive_pdf(job) for record_id, new_path, job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                files = list(executor.map(_render_archive_pdf, [job for record_id, new_path, job in jobs],
+                                          chunksize=8))
+        with conn:
+            for (record_id, new_path, job), filename in zip(jobs, files):
+                if new_path:
+                    conn.execute("UPDATE salary_archive SET pdf_path = ? WHERE id = ?", (filename, record_id))
+                _record_pdf_check(conn, record_id, filename, hash_pdf(filename)[0], "ok")
+    finally:
+        conn.close()
+    return files
+
 
 class SalaryCalculatorApp:
     def __init__(self, root):
@@ -27,6 +1904,17 @@ class SalaryCalculatorApp:
         # Инициализация базы данных
         self.init_database()
 
+        # Кэш запросов на чтение: повторные загрузки списков ничего не стоят, пока база не менялась
+        self.query_cache = QueryCache()
+        self.shown_rows = {}  # представление -> строки, которые в нём сейчас показаны
+
+        # Правила расчёта; если файл правил с ошибкой, работаем по правилам по умолчанию
+        try:
+            get_payroll_plan()
+        except PayrollRulesError as e:
+            messagebox.showerror("Ошибка в правилах расчёта", f"{e}\n\nИспользуются правила по умолчанию.")
+            use_default_payroll_plan()
+
         # Загрузка сотрудников
         self.employee_map = {}  # fio -> (id, position, email, warehouse, salary)
         self.load_employees()
@@ -47,50 +1935,41 @@ class SalaryCalculatorApp:
         # Вкладка календарь
         self.create_calendar_tab()
 
+        # Вкладка сервиса (резервные копии и т.п.)
+        self.create_service_tab()
+
+        # При переключении вкладок подтягиваем изменения, сделанные в других окнах или через сервис
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+
+        # Плановое резервное копирование
+        self.backup_running = False
+        self.root.after(5000, self.scheduled_backup)
+        # Проверка PDF архива в фоне после запуска
+        self.integrity_running = False
+        self.root.after(15000, lambda: self.check_archive_pdfs(silent=True))
+
     def init_database(self):
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS employees (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                fio TEXT NOT NULL,
-                position TEXT,
-                email TEXT,
-                warehouse TEXT,
-                salary REAL
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS salary_archive (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                employee_id INTEGER,
-                fio TEXT,
-                position TEXT,
-                warehouse TEXT,
-                base_salary REAL,
-                fixed_bonus REAL,
-                feoktistov_bonus REAL,
-                overtime REAL,
-                deduction_defect REAL,
-                deduction_absent REAL,
-                total REAL,
-                calc_date TEXT,
-                pdf_path TEXT,
-                FOREIGN KEY (employee_id) REFERENCES employees (id)
-            )
-        ''')
-        conn.commit()
+        conn = connect_db()
+        init_schema(conn)
         conn.close()
 
     def load_employees(self):
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, fio, position, email, warehouse, salary FROM employees")
+        rows = fetch_employees(self.query_cache)
+        if rows is self.shown_rows.get("employee_map"):
+            return False
+        self.shown_rows["employee_map"] = rows
         self.employee_map.clear()
-        for row in cursor.fetchall():
+        for row in rows:
             emp_id, fio, position, email, warehouse, salary = row
             self.employee_map[fio] = (emp_id, position, email, warehouse, salary)
-        conn.close()
+        return True
+
+    def on_tab_changed(self, event=None):
+        if self.load_employees():
+            self.combo_employee['values'] = list(self.employee_map.keys())
+            self.combo_timesheet_employee['values'] = list(self.employee_map.keys())
+        self.refresh_employees()
+        self.load_archive()
 
     def create_calculation_tab(self):
         calc_frame = ttk.Frame(self.notebook, padding=20)
@@ -102,60 +1981,53 @@ class SalaryCalculatorApp:
         self.combo_employee.grid(row=0, column=1, sticky='w', pady=5, padx=(10, 0))
         self.combo_employee.bind("<<ComboboxSelected>>", self.on_employee_select)
 
+        # Поля расчёта строятся по правилам: вводимые компоненты - полями ввода, вычисляемые - подписями
+        self.component_entries = {}
+        self.component_labels = {}
+        row = 1
+        for key, label, sign, formula in get_payroll_plan().components:
+            ttk.Label(calc_frame, text=f"{label} (руб.):", font=("Arial", 11)).grid(row=row, column=0, sticky='w', pady=5)
+            if formula:
+                value_label = ttk.Label(calc_frame, text="0.00", font=("Arial", 11))
+                value_label.grid(row=row, column=1, sticky='w', pady=5, padx=(10, 0))
+                self.component_labels[key] = value_label
+            else:
+                entry = ttk.Entry(calc_frame, width=20)
+                entry.grid(row=row, column=1, sticky='w', pady=5, padx=(10, 0))
+                self.component_entries[key] = entry
+            row += 1
+
         # Окладная ставка (автоподстановка)
-        ttk.Label(calc_frame, text="Окладная ставка (руб.):", font=("Arial", 11)).grid(row=1, column=0, sticky='w', pady=5)
-        self.entry_base_salary = ttk.Entry(calc_frame, width=20)
-        self.entry_base_salary.grid(row=1, column=1, sticky='w', pady=5, padx=(10, 0))
-        self.entry_base_salary.bind("<FocusOut>", self.validate_salary)
-
-        # Фиксированная премия
-        ttk.Label(calc_frame, text="Фиксированная премия (руб.):", font=("Arial", 11)).grid(row=2, column=0, sticky='w', pady=5)
-        self.entry_fixed_bonus = ttk.Entry(calc_frame, width=20)
-        self.entry_fixed_bonus.grid(row=2, column=1, sticky='w', pady=5, padx=(10, 0))
-
-        # Премия от Феоктистова
-        ttk.Label(calc_frame, text="Премия от Феоктистова (руб.):", font=("Arial", 11)).grid(row=3, column=0, sticky='w', pady=5)
-        self.entry_feoktistov_bonus = ttk.Entry(calc_frame, width=20)
-        self.entry_feoktistov_bonus.grid(row=3, column=1, sticky='w', pady=5, padx=(10, 0))
-
-        # Сверхурочные
-        ttk.Label(calc_frame, text="Сверхурочные (руб.):", font=("Arial", 11)).grid(row=4, column=0, sticky='w', pady=5)
-        self.entry_overtime = ttk.Entry(calc_frame, width=20)
-        self.entry_overtime.grid(row=4, column=1, sticky='w', pady=5, padx=(10, 0))
-
-        # Вычеты
-        ttk.Label(calc_frame, text="Вычет за недостачу/пересорт (руб.):", font=("Arial", 11)).grid(row=5, column=0, sticky='w', pady=5)
-        self.entry_deduction_defect = ttk.Entry(calc_frame, width=20)
-        self.entry_deduction_defect.grid(row=5, column=1, sticky='w', pady=5, padx=(10, 0))
-
-        ttk.Label(calc_frame, text="Вычет за дни Б/С (руб.):", font=("Arial", 11)).grid(row=6, column=0, sticky='w', pady=5)
-        self.entry_deduction_absent = ttk.Entry(calc_frame, width=20)
-        self.entry_deduction_absent.grid(row=6, column=1, sticky='w', pady=5, padx=(10, 0))
+        if "base_salary" in self.component_entries:
+            self.component_entries["base_salary"].bind("<FocusOut>", self.validate_salary)
 
         # Дата расчёта (из календаря)
-        ttk.Label(calc_frame, text="Дата расчёта:", font=("Arial", 11)).grid(row=7, column=0, sticky='w', pady=5)
+        ttk.Label(calc_frame, text="Дата расчёта:", font=("Arial", 11)).grid(row=row, column=0, sticky='w', pady=5)
         self.entry_calc_date = ttk.Entry(calc_frame, width=20)
-        self.entry_calc_date.grid(row=7, column=1, sticky='w', pady=5, padx=(10, 0))
+        self.entry_calc_date.grid(row=row, column=1, sticky='w', pady=5, padx=(10, 0))
         self.entry_calc_date.insert(0, datetime.now().strftime("%d.%m.%Y"))
-       
+        row += 1
 
         # Кнопка расчёта
         btn_calc = ttk.Button(calc_frame, text="🔄 Рассчитать", command=self.calculate_salary)
-        btn_calc.grid(row=8, column=0, columnspan=2, pady=15)
+        btn_calc.grid(row=row, column=0, columnspan=2, pady=15)
 
         # Итог
         self.label_total = ttk.Label(calc_frame, text="Итого: 0.00 руб.", font=("Arial", 14, "bold"), foreground="darkgreen")
-        self.label_total.grid(row=9, column=0, columnspan=2, pady=10)
+        self.label_total.grid(row=row + 1, column=0, columnspan=2, pady=10)
 
         # Кнопки действий
         btn_save = ttk.Button(calc_frame, text="💾 Сохранить в архив", command=self.save_to_archive)
-        btn_save.grid(row=10, column=0, pady=10, sticky='e', padx=(0, 10))
+        btn_save.grid(row=row + 2, column=0, pady=10, sticky='e', padx=(0, 10))
 
         btn_print = ttk.Button(calc_frame, text="🖨 Печать", command=self.print_salary_receipt, style="Print.TButton")
-        btn_print.grid(row=10, column=1, pady=10, sticky='w', padx=(10, 0))
+        btn_print.grid(row=row + 2, column=1, pady=10, sticky='w', padx=(10, 0))
 
         btn_email = ttk.Button(calc_frame, text="✉ Отправить на email", command=self.send_salary_by_email, style="Email.TButton")
-        btn_email.grid(row=10, column=2, pady=10, sticky='w', padx=(10, 0))
+        btn_email.grid(row=row + 2, column=2, pady=10, sticky='w', padx=(10, 0))
+
+        btn_preview = ttk.Button(calc_frame, text="👁 Просмотр", command=self.preview_salary_receipt)
+        btn_preview.grid(row=row + 2, column=3, pady=10, sticky='w', padx=(10, 0))
 
         # Стили
         style = ttk.Style()
@@ -166,38 +2038,49 @@ class SalaryCalculatorApp:
         selected = self.combo_employee.get()
         if selected in self.employee_map:
             emp_id, position, email, warehouse, salary = self.employee_map[selected]
-            # Автоподстановка оклада
-            self.entry_base_salary.delete(0, tk.END)
-            self.entry_base_salary.insert(0, f"{salary:.2f}" if salary else "")
-
-            # Очистить остальные поля
-            self.entry_fixed_bonus.delete(0, tk.END)
-            self.entry_feoktistov_bonus.delete(0, tk.END)
-            self.entry_overtime.delete(0, tk.END)
-            self.entry_deduction_defect.delete(0, tk.END)
-            self.entry_deduction_absent.delete(0, tk.END)
+            # Очистить поля
+            for entry in self.component_entries.values():
+                entry.delete(0, tk.END)
+            for value_label in self.component_labels.values():
+                value_label.config(text="0.00")
             self.label_total.config(text="Итого: 0.00 руб.")
 
+            # Автоподстановка оклада
+            if "base_salary" in self.component_entries:
+                self.component_entries["base_salary"].insert(0, f"{salary:.2f}" if salary else "")
+
+            # Вычет за дни Б/С берём из табеля за месяц даты расчёта
+            period = calc_date_period(self.entry_calc_date.get())
+            if period:
+                mask = get_absent_mask(self.query_cache, emp_id, period)
+                if mask and "deduction_absent" in self.component_entries:
+                    self.component_entries["deduction_absent"].insert(
+                        0, f"{absence_deduction(salary, mask, period)[2]:.2f}")
+
     def validate_salary(self, event=None):
         try:
-            val = self.entry_base_salary.get().strip()
+            val = self.component_entries["base_salary"].get().strip()
             if val:
                 float(val)
         except ValueError:
             messagebox.showwarning("Неверный формат", "Оклад должен быть числом.")
 
+    def read_salary_values(self):
+        return {key: float(entry.get() or 0) for key, entry in self.component_entries.items()}
+
+    def evaluate_salary(self):
+        # Все компоненты и итог по правилам; оклад из справочника доступен формулам как salary
+        emp_data = self.employee_map.get(self.combo_employee.get())
+        salary = emp_data[4] if emp_data else 0.0
+        return get_payroll_plan().evaluate(self.read_salary_values(), salary)
+
     def calculate_salary(self):
         try:
-            base_salary = float(self.entry_base_salary.get() or 0)
-            fixed_bonus = float(self.entry_fixed_bonus.get() or 0)
-            feoktistov_bonus = float(self.entry_feoktistov_bonus.get() or 0)
-            overtime = float(self.entry_overtime.get() or 0)
-            deduction_defect = float(self.entry_deduction_defect.get() or 0)
-            deduction_absent = float(self.entry_deduction_absent.get() or 0)
-
-            total = base_salary + fixed_bonus + feoktistov_bonus + overtime - deduction_defect - deduction_absent
-            self.label_total.config(text=f"Итого: {total:,.2f} руб.".replace(',', ' '))
-        except ValueError:
+            values = self.evaluate_salary()
+            for key, value_label in self.component_labels.items():
+                value_label.config(text=f"{values[key]:,.2f}".replace(',', ' '))
+            self.label_total.config(text=f"Итого: {values['total']:,.2f} руб.".replace(',', ' '))
+        except (ValueError, ArithmeticError):
             messagebox.showerror("Ошибка", "Введите корректные числовые значения.")
 
     def print_salary_receipt(self):
@@ -214,96 +2097,12 @@ class SalaryCalculatorApp:
         emp_id, position, email, warehouse, salary = emp_data
 
         try:
-            base_salary = float(self.entry_base_salary.get() or 0)
-            fixed_bonus = float(self.entry_fixed_bonus.get() or 0)
-            feoktistov_bonus = float(self.entry_feoktistov_bonus.get() or 0)
-            overtime = float(self.entry_overtime.get() or 0)
-            deduction_defect = float(self.entry_deduction_defect.get() or 0)
-            deduction_absent = float(self.entry_deduction_absent.get() or 0)
-
-            total = base_salary + fixed_bonus + feoktistov_bonus + overtime - deduction_defect - deduction_absent
+            values = self.evaluate_salary()
+            total = values["total"]
             calc_date = self.entry_calc_date.get() or datetime.now().strftime("%d.%m.%Y")
 
-            # Регистрация шрифтов
-            pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
-            pdfmetrics.registerFont(TTFont('DejaVuBold', 'DejaVuSans-Bold.ttf'))
-
-            filename = f"Зарплата_{selected_employee.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-
-            doc = SimpleDocTemplate(filename, pagesize=A4,
-                                    rightMargin=30, leftMargin=30,
-                                    topMargin=30, bottomMargin=30)
-            styles = getSampleStyleSheet()
-            style_normal = ParagraphStyle(
-                'CustomNormal',
-                parent=styles['Normal'],
-                fontName='DejaVu',
-                fontSize=10,
-                leading=14,
-            )
-            style_bold = ParagraphStyle(
-                'CustomBold',
-                parent=styles['Normal'],
-                fontName='DejaVuBold',
-                fontSize=12,
-                leading=16,
-                alignment=1,
-            )
-
-            story = []
-
-            story.append(Paragraph("📄 РАСЧЁТ ЗАРАБОТНОЙ ПЛАТЫ", style_bold))
-            story.append(Spacer(1, 12))
-
-            data = [
-                ["ФИО:", selected_employee],
-                ["Должность:", position],
-                ["Склад:", warehouse],
-                ["ID сотрудника:", str(emp_id)],
-                ["Дата расчёта:", calc_date],
-            ]
-            table = Table(data, colWidths=[120, 300])
-            table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ]))
-            story.append(table)
-            story.append(Spacer(1, 20))
-
-            salary_data = [
-                ["Позиция", "Сумма (руб.)"],
-                ["Окладная ставка", f"{base_salary:,.2f}".replace(',', ' ')],
-                ["Фиксированная премия", f"{fixed_bonus:,.2f}".replace(',', ' ')],
-                ["Премия от Феоктистова", f"{feoktistov_bonus:,.2f}".replace(',', ' ')],
-                ["Сверхурочные", f"{overtime:,.2f}".replace(',', ' ')],
-                ["Вычет за недостачу и пересорт", f"-{deduction_defect:,.2f}".replace(',', ' ')],
-                ["Вычет за дни Б/С", f"-{deduction_absent:,.2f}".replace(',', ' ')],
-                ["", ""],
-                ["**ИТОГО**", f"**{total:,.2f}**".replace(',', ' ')],
-            ]
-            salary_table = Table(salary_data, colWidths=[300, 120])
-            salary_table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightyellow),
-                ('BACKGROUND', (0, -1), (1, -1), colors.lightgreen),
-                ('FONTNAME', (0, -1), (1, -1), 'DejaVuBold'),
-                ('FONTSIZE', (0, -1), (1, -1), 12),
-            ]))
-            story.append(salary_table)
-            story.append(Spacer(1, 20))
-            story.append(Paragraph("С уважением, бухгалтерский отдел", style_normal))
-            story.append(Paragraph("2026, ООО «Стройсистема»", style_normal))
-
-            doc.build(story)
+            filename = payslip_filename(selected_employee)
+            build_salary_pdf(filename, selected_employee, position, warehouse, emp_id, calc_date, values, total)
 
             # Открытие PDF
             os.startfile(filename)
@@ -311,6 +2110,35 @@ class SalaryCalculatorApp:
         except Exception as e:
             messagebox.showerror("Ошибка генерации PDF", str(e))
 
+    def preview_salary_receipt(self):
+        selected_employee = self.combo_employee.get()
+        if not selected_employee:
+            messagebox.showerror("Ошибка", "Выберите сотрудника.")
+            return
+
+        emp_data = self.employee_map.get(selected_employee)
+        if not emp_data:
+            messagebox.showerror("Ошибка", "Данные сотрудника не найдены.")
+            return
+
+        emp_id, position, email, warehouse, salary = emp_data
+
+        try:
+            values = self.evaluate_salary()
+            total = values["total"]
+            calc_date = self.entry_calc_date.get() or datetime.now().strftime("%d.%m.%Y")
+            lines = get_payroll_plan().lines(values)
+            page = render_payslip_html(selected_employee, position, warehouse, emp_id, calc_date, lines, total)
+
+            # Та же HTML-расчётка, что уходит в письме, открывается в браузере
+            with tempfile.NamedTemporaryFile("w", suffix=".html", prefix="payslip_", delete=False,
+                                             encoding="utf-8") as f:
+                f.write(page)
+            webbrowser.open("file://" + os.path.abspath(f.name))
+
+        except Exception as e:
+            messagebox.showerror("Ошибка", str(e))
+
     def send_salary_by_email(self):
         selected_employee = self.combo_employee.get()
         if not selected_employee:
@@ -328,139 +2156,27 @@ class SalaryCalculatorApp:
             return
 
         try:
-            base_salary = float(self.entry_base_salary.get() or 0)
-            fixed_bonus = float(self.entry_fixed_bonus.get() or 0)
-            feoktistov_bonus = float(self.entry_feoktistov_bonus.get() or 0)
-            overtime = float(self.entry_overtime.get() or 0)
-            deduction_defect = float(self.entry_deduction_defect.get() or 0)
-            deduction_absent = float(self.entry_deduction_absent.get() or 0)
-
-            total = base_salary + fixed_bonus + feoktistov_bonus + overtime - deduction_defect - deduction_absent
+            values = self.evaluate_salary()
+            total = values["total"]
             calc_date = self.entry_calc_date.get() or datetime.now().strftime("%d.%m.%Y")
 
-            # Регистрация шрифтов
-            pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
-            pdfmetrics.registerFont(TTFont('DejaVuBold', 'DejaVuSans-Bold.ttf'))
-
-            filename = f"Зарплата_{selected_employee.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-
-            doc = SimpleDocTemplate(filename, pagesize=A4,
-                                    rightMargin=30, leftMargin=30,
-                                    topMargin=30, bottomMargin=30)
-            styles = getSampleStyleSheet()
-            style_normal = ParagraphStyle(
-                'CustomNormal',
-                parent=styles['Normal'],
-                fontName='DejaVu',
-                fontSize=10,
-                leading=14,
-            )
-            style_bold = ParagraphStyle(
-                'CustomBold',
-                parent=styles['Normal'],
-                fontName='DejaVuBold',
-                fontSize=12,
-                leading=16,
-                alignment=1,
-            )
+            lines = get_payroll_plan().lines(values)
+            html_body = render_payslip_html(selected_employee, position, warehouse, emp_id, calc_date, lines, total)
+            text_body = render_payslip_text(selected_employee, position, warehouse, emp_id, calc_date, lines, total)
+
+            # PDF собираем только для тех, кто его хочет получать
+            conn = connect_db()
+            wants_pdf = employee_wants_pdf(conn, emp_id)
+            conn.close()
+            filename = None
+            if wants_pdf:
+                filename = payslip_filename(selected_employee)
+                build_salary_pdf(filename, selected_employee, position, warehouse, emp_id, calc_date, values, total)
 
-            story = []
-
-            story.append(Paragraph("📄 РАСЧЁТ ЗАРАБОТНОЙ ПЛАТЫ", style_bold))
-            story.append(Spacer(1, 12))
-
-            data = [
-                ["ФИО:", selected_employee],
-                ["Должность:", position],
-                ["Склад:", warehouse],
-                ["ID сотрудника:", str(emp_id)],
-                ["Дата расчёта:", calc_date],
-            ]
-            table = Table(data, colWidths=[120, 300])
-            table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ]))
-            story.append(table)
-            story.append(Spacer(1, 20))
-
-            salary_data = [
-                ["Позиция", "Сумма (руб.)"],
-                ["Окладная ставка", f"{base_salary:,.2f}".replace(',', ' ')],
-                ["Фиксированная премия", f"{fixed_bonus:,.2f}".replace(',', ' ')],
-                ["Премия от Феоктистова", f"{feoktistov_bonus:,.2f}".replace(',', ' ')],
-                ["Сверхурочные", f"{overtime:,.2f}".replace(',', ' ')],
-                ["Вычет за недостачу и пересорт", f"-{deduction_defect:,.2f}".replace(',', ' ')],
-                ["Вычет за дни Б/С", f"-{deduction_absent:,.2f}".replace(',', ' ')],
-                ["", ""],
-                ["**ИТОГО**", f"**{total:,.2f}**".replace(',', ' ')],
-            ]
-            salary_table = Table(salary_data, colWidths=[300, 120])
-            salary_table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightyellow),
-                ('BACKGROUND', (0, -1), (1, -1), colors.lightgreen),
-                ('FONTNAME', (0, -1), (1, -1), 'DejaVuBold'),
-                ('FONTSIZE', (0, -1), (1, -1), 12),
-            ]))
-            story.append(salary_table)
-            story.append(Spacer(1, 20))
-            story.append(Paragraph("С уважением, бухгалтерский отдел", style_normal))
-            story.append(Paragraph("2026, ООО «Стройсистема»", style_normal))
-
-            doc.build(story)
-
-            # Отправка через SMTP (Gmail)
-            smtp_server = "smtp.gmail.com"
-            smtp_port = 587
-            sender_email = "your_company_account@gmail.com"   # ← ЗАМЕНИТЕ НА СВОЙ
-            sender_password = "your_app_password"            # ← ЗАМЕНИТЕ НА APP PASSWORD
-
-            msg = MIMEMultipart()
-            msg['From'] = sender_email
-            msg['To'] = email
-            msg['Subject'] = f"📄 Расчёт заработной платы за {datetime.now().strftime('%B %Y')}"
-
-            body = f"""
-            Добрый день, {selected_employee}!
-
-            Ваш расчёт заработной платы за {datetime.now().strftime('%B %Y')} прилагается в виде PDF-файла.
-
-            Итоговая сумма: {total:,.2f} руб.
-            Склад: {warehouse}
-
-            С уважением,
-            Бухгалтерия компании ООО«Стройсистема»
-            """
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-
-            with open(filename, "rb") as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {filename}',
-                )
-                msg.attach(part)
-
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            server.starttls()
-            server.login(sender_email, sender_password)
-            text = msg.as_string()
-            server.sendmail(sender_email, email, text)
-            server.quit()
-
-            messagebox.showinfo("Успех", f"Чек отправлен на email: {email}\n\nФайл: {filename}")
+            send_payslip_email(email, selected_employee, html_body, text_body, filename)
+
+            attachment = f"Файл: {filename}" if filename else "Без вложения PDF"
+            messagebox.showinfo("Успех", f"Чек отправлен на email: {email}\n\n{attachment}")
 
         except Exception as e:
             messagebox.showerror("Ошибка отправки", f"Не удалось отправить письмо:\n{e}\n\n"
@@ -483,107 +2199,18 @@ class SalaryCalculatorApp:
         emp_id, position, email, warehouse, salary = emp_data
 
         try:
-            base_salary = float(self.entry_base_salary.get() or 0)
-            fixed_bonus = float(self.entry_fixed_bonus.get() or 0)
-            feoktistov_bonus = float(self.entry_feoktistov_bonus.get() or 0)
-            overtime = float(self.entry_overtime.get() or 0)
-            deduction_defect = float(self.entry_deduction_defect.get() or 0)
-            deduction_absent = float(self.entry_deduction_absent.get() or 0)
-
-            total = base_salary + fixed_bonus + feoktistov_bonus + overtime - deduction_defect - deduction_absent
+            values = self.evaluate_salary()
+            total = values["total"]
             calc_date = self.entry_calc_date.get() or datetime.now().strftime("%d.%m.%Y %H:%M")
 
-            # Генерируем имя файла
-            filename = f"Зарплата_{selected_employee.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-
-            # Сохраняем PDF
-            pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
-            pdfmetrics.registerFont(TTFont('DejaVuBold', 'DejaVuSans-Bold.ttf'))
-
-            doc = SimpleDocTemplate(filename, pagesize=A4,
-                                    rightMargin=30, leftMargin=30,
-                                    topMargin=30, bottomMargin=30)
-            styles = getSampleStyleSheet()
-            style_normal = ParagraphStyle(
-                'CustomNormal',
-                parent=styles['Normal'],
-                fontName='DejaVu',
-                fontSize=10,
-                leading=14,
-            )
-            style_bold = ParagraphStyle(
-                'CustomBold',
-                parent=styles['Normal'],
-                fontName='DejaVuBold',
-                fontSize=12,
-                leading=16,
-                alignment=1,
-            )
-
-            story = []
-            story.append(Paragraph("📄 РАСЧЁТ ЗАРАБОТНОЙ ПЛАТЫ", style_bold))
-            story.append(Spacer(1, 12))
-
-            data = [
-                ["ФИО:", selected_employee],
-                ["Должность:", position],
-                ["Склад:", warehouse],
-                ["ID сотрудника:", str(emp_id)],
-                ["Дата расчёта:", calc_date],
-            ]
-            table = Table(data, colWidths=[120, 300])
-            table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ]))
-            story.append(table)
-            story.append(Spacer(1, 20))
-
-            salary_data = [
-                ["Позиция", "Сумма (руб.)"],
-                ["Окладная ставка", f"{base_salary:,.2f}".replace(',', ' ')],
-                ["Фиксированная премия", f"{fixed_bonus:,.2f}".replace(',', ' ')],
-                ["Премия от Феоктистова", f"{feoktistov_bonus:,.2f}".replace(',', ' ')],
-                ["Сверхурочные", f"{overtime:,.2f}".replace(',', ' ')],
-                ["Вычет за недостачу и пересорт", f"-{deduction_defect:,.2f}".replace(',', ' ')],
-                ["Вычет за дни Б/С", f"-{deduction_absent:,.2f}".replace(',', ' ')],
-                ["", ""],
-                ["**ИТОГО**", f"**{total:,.2f}**".replace(',', ' ')],
-            ]
-            salary_table = Table(salary_data, colWidths=[300, 120])
-            salary_table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightyellow),
-                ('BACKGROUND', (0, -1), (1, -1), colors.lightgreen),
-                ('FONTNAME', (0, -1), (1, -1), 'DejaVuBold'),
-                ('FONTSIZE', (0, -1), (1, -1), 12),
-            ]))
-            story.append(salary_table)
-            story.append(Spacer(1, 20))
-            story.append(Paragraph("С уважением, бухгалтерский отдел", style_normal))
-            story.append(Paragraph("2026, ООО «Стройсистема»", style_normal))
-
-            doc.build(story)
+            # Генерируем имя файла и сохраняем PDF
+            filename = payslip_filename(selected_employee)
+            build_salary_pdf(filename, selected_employee, position, warehouse, emp_id, calc_date, values, total)
 
             # Сохраняем в архив базы данных
-            conn = sqlite3.connect('employees.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO salary_archive (employee_id, fio, position, warehouse, base_salary, fixed_bonus, feoktistov_bonus, 
-                overtime, deduction_defect, deduction_absent, total, calc_date, pdf_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (emp_id, selected_employee, position, warehouse, base_salary, fixed_bonus, feoktistov_bonus,
-                  overtime, deduction_defect, deduction_absent, total, calc_date, filename))
-            conn.commit()
+            conn = connect_db()
+            insert_archive_record(conn, emp_id, selected_employee, position, warehouse, values, total,
+                                  calc_date, filename)
             conn.close()
 
             messagebox.showinfo("Успех", f"Запись сохранена в архив.\nФайл: {filename}")
@@ -596,7 +2223,7 @@ class SalaryCalculatorApp:
         self.notebook.add(archive_frame, text="Архив")
 
         # Таблица архива
-        columns = ("id", "fio", "position", "warehouse", "total", "calc_date", "pdf_path")
+        columns = ("id", "fio", "position", "warehouse", "total", "calc_date", "pdf_path", "pdf_status")
         self.archive_tree = ttk.Treeview(archive_frame, columns=columns, show="headings", height=15)
         self.archive_tree.heading("id", text="ID")
         self.archive_tree.heading("fio", text="ФИО")
@@ -605,6 +2232,7 @@ class SalaryCalculatorApp:
         self.archive_tree.heading("total", text="Итого")
         self.archive_tree.heading("calc_date", text="Дата")
         self.archive_tree.heading("pdf_path", text="PDF")
+        self.archive_tree.heading("pdf_status", text="Проверка")
 
         self.archive_tree.column("id", width=40)
         self.archive_tree.column("fio", width=150)
@@ -613,6 +2241,9 @@ class SalaryCalculatorApp:
         self.archive_tree.column("total", width=100)
         self.archive_tree.column("calc_date", width=150)
         self.archive_tree.column("pdf_path", width=200)
+        self.archive_tree.column("pdf_status", width=90)
+        self.archive_tree.tag_configure("missing", background="#f8d7da")
+        self.archive_tree.tag_configure("corrupt", background="#ffe5b4")
 
         scrollbar = ttk.Scrollbar(archive_frame, orient="vertical", command=self.archive_tree.yview)
         self.archive_tree.configure(yscroll=scrollbar.set)
@@ -626,25 +2257,36 @@ class SalaryCalculatorApp:
         btn_delete = ttk.Button(archive_frame, text="🗑 Удалить запись", command=self.delete_selected_record)
         btn_delete.grid(row=1, column=0, sticky='e', pady=5)
 
+        btn_check = ttk.Button(archive_frame, text="🔍 Проверить PDF", command=self.check_archive_pdfs)
+        btn_check.grid(row=2, column=0, sticky='w', pady=5)
+
+        btn_restore_pdf = ttk.Button(archive_frame, text="🛠 Восстановить PDF", command=self.restore_archive_pdfs)
+        btn_restore_pdf.grid(row=2, column=0, sticky='e', pady=5)
+
+        self.label_integrity = ttk.Label(archive_frame, text="", font=("Arial", 10))
+        self.label_integrity.grid(row=3, column=0, sticky='w', pady=2)
+
         archive_frame.grid_columnconfigure(0, weight=1)
         archive_frame.grid_rowconfigure(0, weight=1)
 
         self.load_archive()
 
     def load_archive(self):
+        rows = fetch_archive(self.query_cache)
+        problems = fetch_pdf_problems(self.query_cache)
+        if rows is self.shown_rows.get("archive") and problems is self.shown_rows.get("pdf_problems"):
+            return
+        self.shown_rows["archive"] = rows
+        self.shown_rows["pdf_problems"] = problems
+        status = dict(problems)
+
         for item in self.archive_tree.get_children():
             self.archive_tree.delete(item)
 
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT sa.id, sa.fio, sa.position, sa.warehouse, sa.total, sa.calc_date, sa.pdf_path
-            FROM salary_archive sa
-            ORDER BY sa.calc_date DESC
-        ''')
-        for row in cursor.fetchall():
-            self.archive_tree.insert("", "end", values=row)
-        conn.close()
+        for row in rows:
+            problem = status.get(row[0])
+            self.archive_tree.insert("", "end", values=tuple(row) + (PDF_STATUS_TEXT.get(problem, ""),),
+                                     tags=(problem,) if problem else ())
 
     def open_selected_pdf(self):
         selected = self.archive_tree.selection()
@@ -653,12 +2295,67 @@ class SalaryCalculatorApp:
             return
 
         item = self.archive_tree.item(selected[0])
-        pdf_path = item['values'][6]
-        if not os.path.exists(pdf_path):
-            messagebox.showerror("Ошибка", "Файл PDF не найден на диске.")
+        record_id, pdf_path = item['values'][0], item['values'][6]
+        if not pdf_path or not os.path.exists(pdf_path):
+            if messagebox.askyesno("Файл не найден", "Файл PDF не найден на диске.\n\n"
+                                                     "Сформировать его заново по данным архива?"):
+                def done(files, error):
+                    if error:
+                        messagebox.showerror("Ошибка генерации PDF", str(error))
+                        return
+                    self.load_archive()
+                    os.startfile(files[0])
+
+                self.run_in_background(rerender_archive_pdfs, done, [record_id])
             return
         os.startfile(pdf_path)
 
+    def check_archive_pdfs(self, silent=False):
+        if self.integrity_running:
+            return
+        self.integrity_running = True
+        self.label_integrity.config(text="Идёт проверка PDF архива...")
+
+        def done(summary, error):
+            self.integrity_running = False
+            if error:
+                self.label_integrity.config(text=f"Проверка PDF не выполнена: {error}")
+                if not silent:
+                    messagebox.showerror("Ошибка проверки", str(error))
+                return
+            self.load_archive()
+            text = (f"Проверено записей: {summary['checked']}, файлов: {summary['files']} "
+                    f"за {summary['seconds']:.1f} с. Нет файла: {summary['missing']}, "
+                    f"повреждено: {summary['corrupt']}")
+            self.label_integrity.config(text=text)
+            if not silent:
+                messagebox.showinfo("Проверка PDF", text)
+
+        self.run_in_background(scan_archive_integrity, done)
+
+    def restore_archive_pdfs(self):
+        # Выбранные записи, а если ничего не выбрано - все записи с отсутствующим или повреждённым PDF
+        selected = self.archive_tree.selection()
+        if selected:
+            record_ids = [self.archive_tree.item(item)['values'][0] for item in selected]
+        else:
+            record_ids = [record_id for record_id, status in fetch_pdf_problems(self.query_cache)]
+        if not record_ids:
+            messagebox.showinfo("Восстановление PDF", "Отсутствующих или повреждённых PDF нет.")
+            return
+        if not messagebox.askyesno("Подтверждение", f"Сформировать заново PDF по данным архива "
+                                                    f"для записей: {len(record_ids)}?"):
+            return
+
+        def done(files, error):
+            if error:
+                messagebox.showerror("Ошибка генерации PDF", str(error))
+                return
+            self.load_archive()
+            messagebox.showinfo("Успех", f"Сформировано заново PDF: {len(files)}.")
+
+        self.run_in_background(rerender_archive_pdfs, done, record_ids)
+
     def delete_selected_record(self):
         selected = self.archive_tree.selection()
         if not selected:
@@ -671,10 +2368,8 @@ class SalaryCalculatorApp:
         item = self.archive_tree.item(selected[0])
         record_id = item['values'][0]
 
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM salary_archive WHERE id = ?", (record_id,))
-        conn.commit()
+        conn = connect_db()
+        delete_archive_record(conn, record_id)
         conn.close()
 
         self.load_archive()
@@ -705,8 +2400,12 @@ class SalaryCalculatorApp:
         self.entry_new_salary = ttk.Entry(emp_frame, width=30)
         self.entry_new_salary.grid(row=4, column=1, pady=5, padx=(10, 0))
 
+        self.var_new_email_pdf = tk.BooleanVar(value=True)
+        ttk.Checkbutton(emp_frame, text="Прикладывать PDF к письму", variable=self.var_new_email_pdf).grid(
+            row=5, column=1, sticky='w', pady=5, padx=(10, 0))
+
         btn_add = ttk.Button(emp_frame, text="➕ Добавить сотрудника", command=self.add_employee)
-        btn_add.grid(row=5, column=0, columnspan=2, pady=15)
+        btn_add.grid(row=6, column=0, columnspan=2, pady=15)
 
         # Список сотрудников
         columns_emp = ("id", "fio", "position", "email", "warehouse", "salary")
@@ -728,20 +2427,20 @@ class SalaryCalculatorApp:
         scrollbar_emp = ttk.Scrollbar(emp_frame, orient="vertical", command=self.emp_tree.yview)
         self.emp_tree.configure(yscroll=scrollbar_emp.set)
 
-        self.emp_tree.grid(row=6, column=0, columnspan=2, sticky='nsew', pady=(10, 0))
-        scrollbar_emp.grid(row=6, column=2, sticky='ns', pady=(10, 0))
+        self.emp_tree.grid(row=7, column=0, columnspan=2, sticky='nsew', pady=(10, 0))
+        scrollbar_emp.grid(row=7, column=2, sticky='ns', pady=(10, 0))
 
         btn_delete_emp = ttk.Button(emp_frame, text="🗑 Удалить", command=self.delete_employee)
-        btn_delete_emp.grid(row=7, column=0, sticky='w', pady=10)
+        btn_delete_emp.grid(row=8, column=0, sticky='w', pady=10)
 
         btn_refresh = ttk.Button(emp_frame, text="🔄 Обновить", command=self.refresh_employees)
-        btn_refresh.grid(row=7, column=1, sticky='e', pady=10)
+        btn_refresh.grid(row=8, column=1, sticky='e', pady=10)
 
         # Двойной клик для редактирования
         self.emp_tree.bind("<Double-1>", self.on_employee_double_click)
 
         emp_frame.grid_columnconfigure(1, weight=1)
-        emp_frame.grid_rowconfigure(6, weight=1)
+        emp_frame.grid_rowconfigure(7, weight=1)
 
         self.refresh_employees()
 
@@ -774,23 +2473,28 @@ class SalaryCalculatorApp:
         new_salary = simpledialog.askstring("Редактирование", "Оклад (руб.):", initialvalue=str(salary))
         if new_salary is None: return
 
+        conn = connect_db()
+        email_pdf = employee_wants_pdf(conn, emp_id)
+        conn.close()
+        new_email_pdf = messagebox.askyesnocancel(
+            "Редактирование", f"Прикладывать PDF к письму с расчёткой?\n\nСейчас: {'да' if email_pdf else 'нет'}")
+        if new_email_pdf is None: return
+
         try:
             new_salary = float(new_salary)
         except ValueError:
             messagebox.showerror("Ошибка", "Оклад должен быть числом.")
             return
 
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE employees SET fio=?, position=?, email=?, warehouse=?, salary=? WHERE id=?
-        ''', (new_fio, new_position, new_email, new_warehouse, new_salary, emp_id))
-        conn.commit()
+        conn = connect_db()
+        update_employee(conn, emp_id, new_fio, new_position, new_email, new_warehouse, new_salary)
+        set_employee_email_pdf(conn, emp_id, new_email_pdf)
         conn.close()
 
         self.load_employees()
         self.refresh_employees()
         self.combo_employee['values'] = list(self.employee_map.keys())
+        self.combo_timesheet_employee['values'] = list(self.employee_map.keys())
         messagebox.showinfo("Успех", "Сотрудник обновлён.")
 
     def add_employee(self):
@@ -810,11 +2514,9 @@ class SalaryCalculatorApp:
             messagebox.showerror("Ошибка", "Оклад должен быть числом.")
             return
 
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO employees (fio, position, email, warehouse, salary) VALUES (?, ?, ?, ?, ?)", 
-                       (fio, position, email, warehouse, salary))
-        conn.commit()
+        conn = connect_db()
+        emp_id = insert_employee(conn, fio, position, email, warehouse, salary)
+        set_employee_email_pdf(conn, emp_id, self.var_new_email_pdf.get())
         conn.close()
 
         self.entry_new_fio.delete(0, tk.END)
@@ -822,10 +2524,12 @@ class SalaryCalculatorApp:
         self.entry_new_email.delete(0, tk.END)
         self.entry_new_warehouse.delete(0, tk.END)
         self.entry_new_salary.delete(0, tk.END)
+        self.var_new_email_pdf.set(True)
 
         self.load_employees()
         self.refresh_employees()
         self.combo_employee['values'] = list(self.employee_map.keys())
+        self.combo_timesheet_employee['values'] = list(self.employee_map.keys())
         messagebox.showinfo("Успех", "Сотрудник добавлен.")
 
     def delete_employee(self):
@@ -840,36 +2544,104 @@ class SalaryCalculatorApp:
         if not messagebox.askyesno("Подтверждение", "Удалить сотрудника? Все его записи в архиве останутся."):
             return
 
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM employees WHERE id = ?", (emp_id,))
-        conn.commit()
+        conn = connect_db()
+        delete_employee_row(conn, emp_id)
         conn.close()
 
         self.load_employees()
         self.refresh_employees()
         self.combo_employee['values'] = list(self.employee_map.keys())
+        self.combo_timesheet_employee['values'] = list(self.employee_map.keys())
         messagebox.showinfo("Успех", "Сотрудник удалён.")
 
     def refresh_employees(self):
+        rows = fetch_employees(self.query_cache, order_by_fio=True)
+        if rows is self.shown_rows.get("employees"):
+            return
+        self.shown_rows["employees"] = rows
+
         for item in self.emp_tree.get_children():
             self.emp_tree.delete(item)
 
-        conn = sqlite3.connect('employees.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, fio, position, email, warehouse, salary FROM employees ORDER BY fio")
-        for row in cursor.fetchall():
+        for row in rows:
             self.emp_tree.insert("", "end", values=row)
-        conn.close()
 
     def create_calendar_tab(self):
         cal_frame = ttk.Frame(self.notebook, padding=20)
         self.notebook.add(cal_frame, text="Календарь")
 
-        # Календарь
+        # Сотрудник, для которого ведётся табель
+        ttk.Label(cal_frame, text="Табель сотрудника:", font=("Arial", 11)).grid(row=0, column=0, sticky='w', pady=5)
+        self.combo_timesheet_employee = ttk.Combobox(cal_frame, values=list(self.employee_map.keys()),
+                                                     state="readonly", width=60)
+        self.combo_timesheet_employee.grid(row=0, column=1, sticky='w', pady=5, padx=(10, 0))
+        self.combo_timesheet_employee.bind("<<ComboboxSelected>>", lambda event: self.refresh_timesheet_marks())
+
+        # Календарь: щелчок по дню отмечает/снимает день Б/С у выбранного сотрудника
         self.calendar = Calendar(cal_frame, selectmode='day', year=datetime.now().year, 
-                                 month=datetime.now().month, day=datetime.now().day)
-        self.calendar.grid(row=0, column=0, columnspan=2, pady=10)
+                                 month=datetime.now().month, day=datetime.now().day, date_pattern='mm/dd/y')
+        self.calendar.grid(row=1, column=0, columnspan=2, pady=10)
+        self.calendar.tag_config('absent', background='indianred', foreground='white')
+        self.calendar.bind("<<CalendarSelected>>", self.on_calendar_day_click)
+        self.calendar.bind("<<CalendarMonthChanged>>", lambda event: self.refresh_timesheet_marks())
+
+        self.label_calendar_date = ttk.Label(cal_frame, text="Выбранная дата: —", font=("Arial", 10))
+        self.label_calendar_date.grid(row=2, column=0, columnspan=2, sticky='w', pady=2)
+
+        self.label_timesheet = ttk.Label(cal_frame, text="", font=("Arial", 10))
+        self.label_timesheet.grid(row=3, column=0, columnspan=2, sticky='w', pady=2)
+
+        btn_use_date = ttk.Button(cal_frame, text="📅 Дата в расчёт", command=self.select_date_from_calendar)
+        btn_use_date.grid(row=4, column=0, sticky='w', pady=10)
+
+        btn_deductions = ttk.Button(cal_frame, text="🧮 Вычеты Б/С за месяц по всем",
+                                    command=self.show_month_absence_deductions)
+        btn_deductions.grid(row=4, column=1, sticky='w', pady=10, padx=(10, 0))
+
+    def displayed_period(self):
+        month, year = self.calendar.get_displayed_month()
+        return f"{year:04d}-{month:02d}"
+
+    def refresh_timesheet_marks(self):
+        self.calendar.calevent_remove('all')
+        emp_data = self.employee_map.get(self.combo_timesheet_employee.get())
+        if not emp_data:
+            self.label_timesheet.config(text="Выберите сотрудника, чтобы отмечать дни Б/С.")
+            return
+        emp_id, position, email, warehouse, salary = emp_data
+        period = self.displayed_period()
+        mask = get_absent_mask(self.query_cache, emp_id, period)
+        year, month = int(period[:4]), int(period[5:7])
+        for day in mask_to_days(mask):
+            self.calendar.calevent_create(date(year, month, day), "Б/С", tags='absent')
+        absent_days, working_days, deduction = absence_deduction(salary, mask, period)
+        self.label_timesheet.config(text=f"Дней Б/С: {absent_days} из {working_days} рабочих, "
+                                         f"вычет: {deduction:,.2f} руб.".replace(',', ' '))
+
+    def on_calendar_day_click(self, event=None):
+        selected_day = self.calendar.selection_get()
+        self.label_calendar_date.config(text=f"Выбранная дата: {selected_day.strftime('%d.%m.%Y')}")
+        emp_data = self.employee_map.get(self.combo_timesheet_employee.get())
+        if not emp_data:
+            return
+        conn = connect_db()
+        toggle_absent_day(conn, emp_data[0], selected_day)
+        conn.close()
+        self.refresh_timesheet_marks()
+
+    def show_month_absence_deductions(self):
+        period = self.displayed_period()
+        conn = connect_db()
+        deductions = calculate_absence_deductions(conn, period)
+        conn.close()
+        if not deductions:
+            messagebox.showinfo("Табель", f"За {period} дней Б/С не отмечено.")
+            return
+        names = {data[0]: fio for fio, data in self.employee_map.items()}
+        lines = [f"{names.get(emp_id, emp_id)}: {absent} дн. из {working}, вычет {deduction:,.2f} руб.".replace(',', ' ')
+                 for emp_id, (absent, working, deduction) in sorted(deductions.items(),
+                                                                     key=lambda item: str(names.get(item[0])))]
+        messagebox.showinfo("Вычеты за дни Б/С", f"Период {period}:\n\n" + "\n".join(lines))
 
     def select_date_from_calendar(self):
         selected_date = self.calendar.get_date()  # Формат: MM/DD/YYYY
@@ -879,10 +2651,10 @@ class SalaryCalculatorApp:
             formatted_date = dt.strftime("%d.%m.%Y")
             self.label_calendar_date.config(text=f"Выбранная дата: {formatted_date}")
 
-            # Если текущая вкладка — Расчёт зарплаты, обновляем поле даты
-            if self.notebook.index("current") == 0:  # Индекс вкладки "Расчёт зарплаты"
-                self.entry_calc_date.delete(0, tk.END)
-                self.entry_calc_date.insert(0, formatted_date)
+            # Переносим дату в поле расчёта и переключаемся на вкладку "Расчёт зарплаты"
+            self.entry_calc_date.delete(0, tk.END)
+            self.entry_calc_date.insert(0, formatted_date)
+            self.notebook.select(0)
 
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось обработать дату: {e}")
@@ -901,8 +2673,924 @@ class SalaryCalculatorApp:
         except:
             pass
 
+    def run_in_background(self, func, on_done, *args):
+        # Долгие операции выполняются в потоке; результат забираем в потоке Tk через опрос
+        result = {}
+
+        def worker():
+            try:
+                result["value"] = func(*args)
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+        def poll():
+            if thread.is_alive():
+                self.root.after(100, poll)
+            else:
+                on_done(result.get("value"), result.get("error"))
+
+        self.root.after(100, poll)
+
+    def create_service_tab(self):
+        service_frame = ttk.Frame(self.notebook, padding=20)
+        self.notebook.add(service_frame, text="Сервис")
+
+        backup_box = ttk.LabelFrame(service_frame, text="Резервные копии", padding=10)
+        backup_box.grid(row=0, column=0, sticky='ew', pady=5)
+
+        btn_backup = ttk.Button(backup_box, text="💾 Создать резервную копию", command=self.backup_now)
+        btn_backup.grid(row=0, column=0, sticky='w', pady=5)
+
+        btn_restore = ttk.Button(backup_box, text="♻ Восстановить из копии...", command=self.restore_from_backup)
+        btn_restore.grid(row=0, column=1, sticky='w', pady=5, padx=(10, 0))
+
+        self.label_backup = ttk.Label(backup_box, text=self.describe_last_backup(), font=("Arial", 10))
+        self.label_backup.grid(row=1, column=0, columnspan=2, sticky='w', pady=5)
+
+        sim_box = ttk.LabelFrame(service_frame, text="Моделирование: что если изменить премии и сверхурочные",
+                                 padding=10)
+        sim_box.grid(row=1, column=0, sticky='nsew', pady=5)
+
+        self.sim_entries = {}
+        sim_params = [
+            ("months", "Период, месяцев:", "12"),
+            ("fixed_bonus_amount", "Фиксированная премия, руб. (пусто - без изменений):", ""),
+            ("fixed_bonus_factor", "Коэффициент фиксированной премии:", "1.0"),
+            ("feoktistov_bonus_factor", "Коэффициент премии от Феоктистова:", "1.0"),
+            ("overtime_factor", "Коэффициент сверхурочных:", "1.0"),
+        ]
+        for row, (key, label, default) in enumerate(sim_params):
+            ttk.Label(sim_box, text=label, font=("Arial", 10)).grid(row=row, column=0, sticky='w', pady=2)
+            entry = ttk.Entry(sim_box, width=15)
+            entry.insert(0, default)
+            entry.grid(row=row, column=1, sticky='w', pady=2, padx=(10, 0))
+            self.sim_entries[key] = entry
+
+        btn_simulate = ttk.Button(sim_box, text="📊 Рассчитать", command=self.run_simulation)
+        btn_simulate.grid(row=len(sim_params), column=0, sticky='w', pady=5)
+
+        columns_sim = ("warehouse", "rows", "current", "simulated", "delta")
+        self.sim_tree = ttk.Treeview(sim_box, columns=columns_sim, show="headings", height=8)
+        self.sim_tree.heading("warehouse", text="Склад")
+        self.sim_tree.heading("rows", text="Записей")
+        self.sim_tree.heading("current", text="Сейчас")
+        self.sim_tree.heading("simulated", text="По сценарию")
+        self.sim_tree.heading("delta", text="Разница")
+        for column in columns_sim:
+            self.sim_tree.column(column, width=130)
+        self.sim_tree.grid(row=len(sim_params) + 1, column=0, columnspan=2, sticky='nsew', pady=5)
+
+        sim_box.grid_columnconfigure(1, weight=1)
+        sim_box.grid_rowconfigure(len(sim_params) + 1, weight=1)
+
+        run_box = ttk.LabelFrame(service_frame, text="Расчёт за месяц по всем сотрудникам", padding=10)
+        run_box.grid(row=2, column=0, sticky='ew', pady=5)
+
+        self.run_entries = {}
+        run_params = [
+            ("period", "Месяц (ГГГГ-ММ):", datetime.now().strftime("%Y-%m")),
+            ("fixed_bonus", "Фиксированная премия (руб.):", ""),
+            ("feoktistov_bonus", "Премия от Феоктистова (руб.):", ""),
+        ]
+        for row, (key, label, default) in enumerate(run_params):
+            ttk.Label(run_box, text=label, font=("Arial", 10)).grid(row=row, column=0, sticky='w', pady=2)
+            entry = ttk.Entry(run_box, width=15)
+            entry.insert(0, default)
+            entry.grid(row=row, column=1, sticky='w', pady=2, padx=(10, 0))
+            self.run_entries[key] = entry
+
+        self.var_run_email = tk.BooleanVar(value=False)
+        ttk.Checkbutton(run_box, text="Отправить расчётки на email", variable=self.var_run_email).grid(
+            row=len(run_params), column=0, columnspan=2, sticky='w', pady=2)
+
+        btn_run = ttk.Button(run_box, text="▶ Запустить", command=self.start_payroll_run)
+        btn_run.grid(row=len(run_params) + 1, column=0, sticky='w', pady=5)
+
+        btn_resume = ttk.Button(run_box, text="⏯ Продолжить прерванный", command=self.resume_payroll_run)
+        btn_resume.grid(row=len(run_params) + 1, column=1, sticky='w', pady=5, padx=(10, 0))
+
+        btn_cancel_run = ttk.Button(run_box, text="✖ Закрыть прерванный", command=self.cancel_unfinished_payroll_run)
+        btn_cancel_run.grid(row=len(run_params) + 1, column=2, sticky='w', pady=5, padx=(10, 0))
+
+        self.label_run = ttk.Label(run_box, text="", font=("Arial", 10))
+        self.label_run.grid(row=len(run_params) + 2, column=0, columnspan=3, sticky='w', pady=2)
+
+        statements_box = ttk.LabelFrame(service_frame, text="Годовые справки о начислениях", padding=10)
+        statements_box.grid(row=3, column=0, sticky='ew', pady=5)
+
+        ttk.Label(statements_box, text="Год:", font=("Arial", 10)).grid(row=0, column=0, sticky='w', pady=2)
+        self.entry_statement_year = ttk.Entry(statements_box, width=8)
+        self.entry_statement_year.insert(0, str(datetime.now().year))
+        self.entry_statement_year.grid(row=0, column=1, sticky='w', pady=2, padx=(10, 0))
+
+        btn_statements = ttk.Button(statements_box, text="📑 Сформировать справки по всем",
+                                    command=self.generate_statements)
+        btn_statements.grid(row=0, column=2, sticky='w', pady=2, padx=(10, 0))
+
+        sync_box = ttk.LabelFrame(service_frame, text="Обмен изменениями между офисами", padding=10)
+        sync_box.grid(row=4, column=0, sticky='ew', pady=5)
+
+        ttk.Label(sync_box, text="Выгрузить изменения после №:", font=("Arial", 10)).grid(row=0, column=0, sticky='w',
+                                                                                           pady=2)
+        self.entry_sync_since = ttk.Entry(sync_box, width=10)
+        self.entry_sync_since.insert(0, "0")
+        self.entry_sync_since.grid(row=0, column=1, sticky='w', pady=2, padx=(10, 0))
+
+        btn_export = ttk.Button(sync_box, text="📤 Выгрузить...", command=self.export_changes)
+        btn_export.grid(row=0, column=2, sticky='w', pady=2, padx=(10, 0))
+
+        btn_import = ttk.Button(sync_box, text="📥 Загрузить файл изменений...", command=self.import_changes)
+        btn_import.grid(row=0, column=3, sticky='w', pady=2, padx=(10, 0))
+
+        self.label_sync = ttk.Label(sync_box, text="", font=("Arial", 10))
+        self.label_sync.grid(row=1, column=0, columnspan=4, sticky='w', pady=2)
+        self.refresh_sync_state()
+
+        self.run_progress = None
+        conn = connect_db()
+        unfinished = find_unfinished_payroll_run(conn)
+        conn.close()
+        if unfinished:
+            self.label_run.config(text=f"Есть прерванный запуск №{unfinished} - его можно продолжить или закрыть.")
+        service_frame.grid_columnconfigure(0, weight=1)
+        service_frame.grid_rowconfigure(1, weight=1)
+
+    def describe_last_backup(self):
+        backups = list_backups()
+        if not backups:
+            return "Резервных копий пока нет."
+        last = datetime.fromtimestamp(os.path.getmtime(backups[0])).strftime("%d.%m.%Y %H:%M")
+        return f"Последняя копия: {last} ({os.path.basename(backups[0])}), всего копий: {len(backups)}"
+
+    def start_backup(self, silent):
+        if self.backup_running:
+            return
+        self.backup_running = True
+
+        def done(info, error):
+            self.backup_running = False
+            self.label_backup.config(text=self.describe_last_backup())
+            if error:
+                messagebox.showerror("Ошибка резервного копирования", str(error))
+            elif not silent:
+                messagebox.showinfo("Успех", f"Резервная копия создана и проверена.\nФайл: {info['path']}\n"
+                                             f"Шагов: {info['steps']}, макс. блокировка на шаге: "
+                                             f"{info['max_step_ms']:.1f} мс")
+
+        self.run_in_background(backup_database, done)
+
+    def backup_now(self):
+        self.start_backup(silent=False)
+
+    def scheduled_backup(self):
+        if backup_is_due():
+            self.start_backup(silent=True)
+        # Проверяем раз в час
+        self.root.after(3600 * 1000, self.scheduled_backup)
+
+    def run_simulation(self):
+        try:
+            months = int(self.sim_entries["months"].get() or 12)
+            amount = self.sim_entries["fixed_bonus_amount"].get().strip()
+            scenario = {
+                "name": "Сценарий",
+                "fixed_bonus_amount": float(amount) if amount else None,
+                "fixed_bonus_factor": float(self.sim_entries["fixed_bonus_factor"].get() or 1),
+                "feoktistov_bonus_factor": float(self.sim_entries["feoktistov_bonus_factor"].get() or 1),
+                "overtime_factor": float(self.sim_entries["overtime_factor"].get() or 1),
+            }
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите корректные числовые значения.")
+            return
+
+        conn = connect_db()
+        archive_columns = load_archive_columns(conn, months)
+        conn.close()
+        result = simulate_scenarios(archive_columns, [scenario])["Сценарий"]
+
+        for item in self.sim_tree.get_children():
+            self.sim_tree.delete(item)
+        totals = {"rows": 0, "current": 0.0, "simulated": 0.0, "delta": 0.0}
+        for warehouse, data in sorted(result.items()):
+            for key in totals:
+                totals[key] += data[key]
+            self.sim_tree.insert("", "end", values=(warehouse or "—", data["rows"],
+                                                    f"{data['current']:,.2f}".replace(',', ' '),
+                                                    f"{data['simulated']:,.2f}".replace(',', ' '),
+                                                    f"{data['delta']:+,.2f}".replace(',', ' ')))
+        self.sim_tree.insert("", "end", values=("ИТОГО", totals["rows"],
+                                                f"{totals['current']:,.2f}".replace(',', ' '),
+                                                f"{totals['simulated']:,.2f}".replace(',', ' '),
+                                                f"{totals['delta']:+,.2f}".replace(',', ' ')))
+
+    def start_payroll_run(self):
+        if self.run_progress is not None:
+            messagebox.showwarning("Предупреждение", "Расчёт уже выполняется.")
+            return
+        period = self.run_entries["period"].get().strip()
+        if not re.match(r"^\d{4}-(0[1-9]|1[0-2])$", period):
+            messagebox.showerror("Ошибка", "Месяц укажите в формате ГГГГ-ММ.")
+            return
+        try:
+            params = {
+                "fixed_bonus": float(self.run_entries["fixed_bonus"].get() or 0),
+                "feoktistov_bonus": float(self.run_entries["feoktistov_bonus"].get() or 0),
+                "use_timesheet": True,
+                "send_email": self.var_run_email.get(),
+            }
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите корректные числовые значения.")
+            return
+
+        conn = connect_db()
+        unfinished = find_unfinished_payroll_run(conn)
+        done_before = conn.execute("SELECT id FROM payroll_run WHERE period = ? AND status = 'done'",
+                                   (period,)).fetchone()
+        if unfinished:
+            answer = messagebox.askyesnocancel("Прерванный запуск",
+                                               f"Запуск №{unfinished} не завершён. Продолжить его вместо нового?\n\n"
+                                               f"\"Нет\" - закрыть его (записанное в архив останется) и начать новый.")
+            if answer is None:
+                conn.close()
+                return
+            if answer:
+                conn.close()
+                self.resume_payroll_run()
+                return
+            cancel_payroll_run(conn, unfinished)
+        if done_before and not messagebox.askyesno("Подтверждение",
+                                                   f"За {period} уже был выполнен запуск №{done_before[0]}. "
+                                                   f"Сделать ещё один?"):
+            conn.close()
+            return
+        run_id = create_payroll_run(conn, period, period_calc_date(period), params)
+        conn.close()
+        self.execute_payroll_run_in_background(run_id)
+
+    def resume_payroll_run(self):
+        if self.run_progress is not None:
+            messagebox.showwarning("Предупреждение", "Расчёт уже выполняется.")
+            return
+        conn = connect_db()
+        run_id = find_unfinished_payroll_run(conn)
+        conn.close()
+        if not run_id:
+            messagebox.showinfo("Расчёт за месяц", "Незавершённых запусков нет.")
+            return
+        self.execute_payroll_run_in_background(run_id)
+
+    def cancel_unfinished_payroll_run(self):
+        conn = connect_db()
+        try:
+            run_id = find_unfinished_payroll_run(conn)
+            if not run_id:
+                messagebox.showinfo("Расчёт за месяц", "Незавершённых запусков нет.")
+                return
+            summary = payroll_run_summary(conn, run_id)
+            if not messagebox.askyesno("Подтверждение",
+                                       f"Закрыть запуск №{run_id} ({summary['period']}) без завершения?\n"
+                                       f"Ошибок: {len(summary['errors'])}. Записанное в архив останется."):
+                return
+            cancel_payroll_run(conn, run_id)
+        finally:
+            conn.close()
+        self.label_run.config(text=f"Запуск №{run_id} закрыт без завершения.")
+
+    def execute_payroll_run_in_background(self, run_id):
+        self.run_progress = {"run_id": run_id, "done": 0, "total": 0}
+
+        def progress(done, total):
+            self.run_progress["done"], self.run_progress["total"] = done, total
+
+        def show_progress():
+            if self.run_progress is None:
+                return
+            self.label_run.config(text=f"Запуск №{run_id}: обработано {self.run_progress['done']} "
+                                       f"из {self.run_progress['total']}")
+            self.root.after(500, show_progress)
+
+        def done(summary, error):
+            self.run_progress = None
+            self.load_archive()
+            if error:
+                self.label_run.config(text=f"Запуск №{run_id} прерван: {error}")
+                messagebox.showerror("Ошибка расчёта", str(error))
+                return
+            steps = summary["steps"]
+            text = (f"Запуск №{run_id} ({summary['period']}): в архиве {steps['archived'] + steps['mailed']}, "
+                    f"отправлено {steps['mailed']}, ошибок {len(summary['errors'])}")
+            if summary["status"] == "cancelled":
+                text += " - запуск закрыт"
+            elif summary["status"] != "done":
+                text += " - запуск можно продолжить"
+            self.label_run.config(text=text)
+            if summary["errors"]:
+                names = {data[0]: fio for fio, data in self.employee_map.items()}
+                lines = [f"{names.get(e['employee_id'], e['employee_id'])}: {e['error']}" for e in summary["errors"]]
+                messagebox.showwarning("Расчёт за месяц", "Не все сотрудники обработаны:\n\n" + "\n".join(lines[:20]))
+
+        show_progress()
+        self.run_in_background(execute_payroll_run, done, run_id, None, progress)
+
+    def generate_statements(self):
+        try:
+            year = int(self.entry_statement_year.get())
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите год числом.")
+            return
+        out_dir = filedialog.askdirectory(title="Папка для справок", initialdir=os.path.abspath("."))
+        if not out_dir:
+            return
+        started = time.perf_counter()
+
+        def done(files, error):
+            if error:
+                messagebox.showerror("Ошибка формирования справок", str(error))
+            elif not files:
+                messagebox.showinfo("Годовые справки", f"За {year} год в архиве нет начислений.")
+            else:
+                messagebox.showinfo("Успех", f"Сформировано справок: {len(files)} за "
+                                             f"{time.perf_counter() - started:.1f} с.\nПапка: {out_dir}")
+
+        self.run_in_background(generate_annual_statements, done, year, out_dir)
+
+    def refresh_sync_state(self):
+        conn = connect_db()
+        node, seq, peers = sync_node_id(conn), last_change_seq(conn), sync_peers(conn)
+        conn.close()
+        text = f"Этот офис: {node[:8]}, последний номер изменения: {seq}"
+        for peer, last_seq in peers:
+            text += f"\nПринято от {peer[:8]}: до №{last_seq}"
+        self.label_sync.config(text=text)
+
+    def export_changes(self):
+        try:
+            since = int(self.entry_sync_since.get() or 0)
+        except ValueError:
+            messagebox.showerror("Ошибка", "Номер изменения должен быть целым числом.")
+            return
+        conn = connect_db()
+        node, until = sync_node_id(conn), last_change_seq(conn)
+        conn.close()
+        path = filedialog.asksaveasfilename(title="Файл изменений", defaultextension=".json.gz",
+                                            initialfile=f"changes_{node[:8]}_{since + 1}-{until}.json.gz",
+                                            filetypes=[("Файл изменений", "*.json.gz")])
+        if not path:
+            return
+
+        def done(info, error):
+            if error:
+                messagebox.showerror("Ошибка выгрузки", str(error))
+                return
+            messagebox.showinfo("Успех", f"Выгружены изменения №{info['since'] + 1}-{info['until']}: "
+                                         f"сотрудников {info['employees']}, записей архива {info['salary_archive']}."
+                                         f"\nФайл: {info['path']}")
+
+        self.run_in_background(export_changeset, done, since, path)
+
+    def import_changes(self):
+        path = filedialog.askopenfilename(title="Файл изменений", filetypes=[("Файл изменений", "*.json.gz")])
+        if not path:
+            return
+
+        def done(summary, error):
+            if error:
+                messagebox.showerror("Ошибка загрузки", str(error))
+                return
+            self.load_employees()
+            self.refresh_employees()
+            self.combo_employee['values'] = list(self.employee_map.keys())
+            self.combo_timesheet_employee['values'] = list(self.employee_map.keys())
+            self.load_archive()
+            self.refresh_sync_state()
+            text = (f"Офис {summary['node'][:8]}, изменения до №{summary['until']}: "
+                    f"применено {summary['applied']}, пропущено {summary['skipped']}.")
+            if summary["unlinked"]:
+                messagebox.showwarning("Загрузка изменений", text + f"\n\nЗаписей архива без сотрудника: "
+                                       f"{len(summary['unlinked'])}. Запросите у этого офиса выгрузку с №0.")
+                return
+            messagebox.showinfo("Успех", text)
+
+        self.run_in_background(import_changeset, done, path)
+
+    def restore_from_backup(self):
+        path = filedialog.askopenfilename(title="Выберите резервную копию", initialdir=os.path.abspath(BACKUP_DIR),
+                                          filetypes=[("База SQLite", "*.db")])
+        if not path:
+            return
+        if not messagebox.askyesno("Подтверждение", "Текущие данные будут заменены данными из копии.\n"
+                                                    "Перед этим будет сделана копия текущего состояния. Продолжить?"):
+            return
+
+        def done(safety_path, error):
+            if error:
+                messagebox.showerror("Ошибка восстановления", str(error))
+                return
+            self.load_employees()
+            self.refresh_employees()
+            self.combo_employee['values'] = list(self.employee_map.keys())
+            self.combo_timesheet_employee['values'] = list(self.employee_map.keys())
+            self.load_archive()
+            self.label_backup.config(text=self.describe_last_backup())
+            self.refresh_sync_state()
+            messagebox.showinfo("Успех", f"Данные восстановлены.\nПрежнее состояние сохранено в: {safety_path}\n\n"
+                                         f"База стала новым узлом обмена: другим офисам выгрузите изменения с №0.")
+
+        self.run_in_background(restore_database, done, path)
+
+
+def read_file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def is_loopback_host(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class PayrollApiServer:
+    # Локальный HTTP/JSON-сервис поверх той же базы, что и окно программы.
+    # Запись идёт через единственный поток и одно соединение (SQLite допускает одного писателя),
+    # чтение - через пул потоков, у каждого потока своё соединение (в WAL читатели не блокируют друг друга).
+    STATUS_TEXT = {200: "OK", 201: "Created", 202: "Accepted", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+                   404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                   500: "Internal Server Error"}
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, host="127.0.0.1", port=8765, db_path=None, token=None, readers=4):
+        # Без токена сервис доступен только с этого компьютера: в нём зарплаты и удаление записей
+        if not token and not is_loopback_host(host):
+            raise ValueError(f"Адрес {host} доступен из сети: задайте токен (--token или RASCHETNIK_TOKEN)")
+        self.host = host
+        self.port = port
+        self.db_path = db_path or DB_PATH
+        self.token = token
+        self.read_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="api-read")
+        self.write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-write")
+        self.local = threading.local()
+        self.active_runs = set()
+        self.routes = [
+            ("GET", re.compile(r"^/employees$"), self.list_employees),
+            ("POST", re.compile(r"^/employees$"), self.create_employee),
+            ("GET", re.compile(r"^/employees/(\d+)$"), self.get_employee),
+            ("PUT", re.compile(r"^/employees/(\d+)$"), self.change_employee),
+            ("DELETE", re.compile(r"^/employees/(\d+)$"), self.remove_employee),
+            ("GET", re.compile(r"^/rules$"), self.rules),
+            ("POST", re.compile(r"^/calculate$"), self.calculate),
+            ("GET", re.compile(r"^/archive$"), self.list_archive),
+            ("POST", re.compile(r"^/archive$"), self.create_archive_record),
+            ("GET", re.compile(r"^/archive/(\d+)$"), self.get_archive_record),
+            ("GET", re.compile(r"^/archive/(\d+)/pdf$"), self.download_payslip),
+            ("GET", re.compile(r"^/archive/(\d+)/html$"), self.payslip_html),
+            ("POST", re.compile(r"^/simulate$"), self.simulate),
+            ("GET", re.compile(r"^/timesheet/(\d{4}-\d{2})$"), self.month_timesheet),
+            ("GET", re.compile(r"^/statements/(\d{4})$"), self.annual_statements),
+            ("POST", re.compile(r"^/payroll-runs$"), self.create_payroll_run),
+            ("GET", re.compile(r"^/payroll-runs/(\d+)$"), self.get_payroll_run),
+            ("POST", re.compile(r"^/payroll-runs/(\d+)/resume$"), self.resume_payroll_run),
+            ("POST", re.compile(r"^/payroll-runs/(\d+)/cancel$"), self.cancel_payroll_run),
+            ("PUT", re.compile(r"^/timesheet/(\d{4}-\d{2})/(\d+)$"), self.change_timesheet),
+        ]
+
+        conn = connect_db(self.db_path)
+        init_schema(conn)
+        conn.close()
+        # Ошибка в правилах расчёта должна остановить запуск сервиса, а не всплыть на первом запросе
+        get_payroll_plan()
+
+    # --- доступ к базе ---
+
+    def _conn(self):
+        # Соединение создаётся один раз на поток пула и дальше переиспользуется
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = connect_db(self.db_path)
+            self.local.conn = conn
+        return conn
+
+    def _cache(self):
+        # Читатели работают через кэш запросов своего потока
+        cache = getattr(self.local, "cache", None)
+        if cache is None:
+            cache = QueryCache(self.db_path)
+            self.local.cache = cache
+        return cache
+
+    async def read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.read_pool, lambda: func(self._cache(), *args))
+
+    async def write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.write_pool, lambda: func(self._conn(), *args))
+
+    # --- обработчики ---
+
+    async def list_employees(self, query, body):
+        rows = await self.read(fetch_employees, True)
+        return 200, [dict(zip(EMPLOYEE_COLUMNS, row)) for row in rows]
+
+    async def get_employee(self, query, body, emp_id):
+        row = await self.read(fetch_employee, int(emp_id))
+        if row is None:
+            raise ApiError(404, "Сотрудник не найден")
+        employee = dict(zip(EMPLOYEE_COLUMNS, row))
+        employee["email_pdf"] = await self.read(employee_wants_pdf, int(emp_id))
+        return 200, employee
+
+    def _employee_fields(self, body):
+        fio = str(body.get("fio") or "").strip()
+        if not fio:
+            raise ApiError(400, "Введите ФИО")
+        try:
+            salary = float(body.get("salary") or 0)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Оклад должен быть числом")
+        return (fio, str(body.get("position") or "").strip(), str(body.get("email") or "").strip(),
+                str(body.get("warehouse") or "").strip(), salary)
+
+    async def create_employee(self, query, body):
+        emp_id = await self.write(insert_employee, *self._employee_fields(body))
+        if "email_pdf" in body:
+            await self.write(set_employee_email_pdf, emp_id, body["email_pdf"])
+        status, employee = await self.get_employee(query, None, emp_id)
+        return 201, employee
+
+    async def change_employee(self, query, body, emp_id):
+        if not await self.write(update_employee, int(emp_id), *self._employee_fields(body)):
+            raise ApiError(404, "Сотрудник не найден")
+        if "email_pdf" in body:
+            await self.write(set_employee_email_pdf, int(emp_id), body["email_pdf"])
+        return await self.get_employee(query, None, emp_id)
+
+    async def remove_employee(self, query, body, emp_id):
+        if not await self.write(delete_employee_row, int(emp_id)):
+            raise ApiError(404, "Сотрудник не найден")
+        return 204, None
+
+    def _salary_values(self, body, salary=0.0):
+        plan = get_payroll_plan()
+        values = {key: body[key] for key in plan.inputs if key in body}
+        if "base_salary" in plan.inputs and "base_salary" not in body:
+            values["base_salary"] = salary
+        try:
+            return plan.evaluate(values, salary)
+        except (TypeError, ValueError, ArithmeticError):
+            raise ApiError(400, "Введите корректные числовые значения")
+
+    async def rules(self, query, body):
+        plan = get_payroll_plan()
+        return 200, [{"key": key, "label": label, "kind": "accrual" if sign > 0 else "deduction",
+                      "formula": formula or None, "input": not formula}
+                     for key, label, sign, formula in plan.components]
+
+    async def calculate(self, query, body):
+        try:
+            salary = float(body.get("salary") or 0)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Оклад должен быть числом")
+        return 200, self._salary_values(body, salary)
+
+    async def list_archive(self, query, body):
+        try:
+            employee_id = int(query["employee_id"][0]) if "employee_id" in query else None
+            limit = int(query["limit"][0]) if "limit" in query else None
+        except ValueError:
+            raise ApiError(400, "employee_id и limit должны быть целыми числами")
+        warehouse = query["warehouse"][0] if "warehouse" in query else None
+        rows = await self.read(fetch_archive, employee_id, warehouse, limit)
+        columns = ("id", "fio", "position", "warehouse", "total", "calc_date", "pdf_path")
+        return 200, [dict(zip(columns, row)) for row in rows]
+
+    async def get_archive_record(self, query, body, record_id):
+        row = await self.read(fetch_archive_record, int(record_id))
+        if row is None:
+            raise ApiError(404, "Запись архива не найдена")
+        record = dict(zip(ARCHIVE_COLUMNS, row))
+        record["components"] = [{"key": key, "label": label, "sign": sign, "amount": amount}
+                                for key, label, sign, amount in await self.read(fetch_archive_components,
+                                                                                int(record_id))]
+        return 200, record
+
+    async def create_archive_record(self, query, body):
+        try:
+            emp_id = int(body.get("employee_id"))
+        except (TypeError, ValueError):
+            raise ApiError(400, "Укажите employee_id")
+        employee = await self.read(fetch_employee, emp_id)
+        if employee is None:
+            raise ApiError(404, "Сотрудник не найден")
+        _, fio, position, email, warehouse, salary = employee
+        values = self._salary_values(body, float(salary or 0))
+        total = values["total"]
+        calc_date = body.get("calc_date") or datetime.now().strftime("%d.%m.%Y %H:%M")
+
+        # PDF строится в пуле чтения, чтобы не задерживать очередь записи
+        filename = payslip_filename(fio)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.read_pool, build_salary_pdf, filename, fio, position, warehouse,
+                                   emp_id, calc_date, values, total)
+        record_id = await self.write(insert_archive_record, emp_id, fio, position, warehouse, values, total,
+                                     calc_date, filename)
+        status, record = await self.get_archive_record(query, None, record_id)
+        return 201, record
+
+    async def download_payslip(self, query, body, record_id):
+        row = await self.read(fetch_archive_record, int(record_id))
+        if row is None:
+            raise ApiError(404, "Запись архива не найдена")
+        pdf_path = row[ARCHIVE_COLUMNS.index("pdf_path")]
+        if not pdf_path or not os.path.exists(pdf_path):
+            raise ApiError(404, "Файл PDF не найден на диске")
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self.read_pool, read_file_bytes, pdf_path)
+        return 200, (data, "application/pdf", os.path.basename(pdf_path))
+
+    async def payslip_html(self, query, body, record_id):
+        row = await self.read(fetch_archive_record, int(record_id))
+        if row is None:
+            raise ApiError(404, "Запись архива не найдена")
+        record = dict(zip(ARCHIVE_COLUMNS, row))
+        # Строки берутся из сохранённых компонентов, а не пересчитываются по текущим правилам
+        lines = [(label, sign, amount) for key, label, sign, amount
+                 in await self.read(fetch_archive_components, int(record_id))]
+        page = render_payslip_html(record["fio"], record["position"], record["warehouse"], record["employee_id"],
+                                   record["calc_date"], lines, record["total"])
+        return 200, (page.encode("utf-8"), "text/html; charset=utf-8", f"payslip_{record_id}.html")
+
+    async def simulate(self, query, body):
+        scenarios = body.get("scenarios")
+        if not isinstance(scenarios, list) or not all(isinstance(item, dict) for item in scenarios):
+            raise ApiError(400, "Передайте список сценариев в поле scenarios")
+        try:
+            months = int(body.get("months") or 12)
+            archive_columns = await self.read(load_archive_columns, months)
+            result = simulate_scenarios(archive_columns, scenarios)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Параметры сценария должны быть числами")
+        first_period, last_period = archive_columns["period"]
+        return 200, {"period_from": first_period, "period_to": last_period, "scenarios": result}
+
+    def _month_timesheet(self, conn, period):
+        deductions = calculate_absence_deductions(conn, period)
+        masks = dict(conn.execute("SELECT employee_id, absent_mask FROM timesheet WHERE period = ?", (period,)))
+        return [{"employee_id": emp_id, "absent_days": mask_to_days(masks[emp_id]), "absent_working_days": absent,
+                 "working_days": working, "deduction_absent": deduction}
+                for emp_id, (absent, working, deduction) in sorted(deductions.items())]
+
+    async def month_timesheet(self, query, body, period):
+        if not "01" <= period[5:] <= "12":
+            raise ApiError(400, "Некорректный месяц")
+        return 200, await self.read(self._month_timesheet, period)
+
+    async def change_timesheet(self, query, body, period, emp_id):
+        if not "01" <= period[5:] <= "12":
+            raise ApiError(400, "Некорректный месяц")
+        days_in_month = calendar.monthrange(int(period[:4]), int(period[5:]))[1]
+        days = body.get("absent_days")
+        if not isinstance(days, list) or not all(isinstance(d, int) and 1 <= d <= days_in_month for d in days):
+            raise ApiError(400, "absent_days - список дней месяца")
+        if await self.read(fetch_employee, int(emp_id)) is None:
+            raise ApiError(404, "Сотрудник не найден")
+        await self.write(set_absent_mask, int(emp_id), period, days_to_mask(days))
+        return 200, {"employee_id": int(emp_id), "period": period, "absent_days": sorted(set(days))}
+
+    async def annual_statements(self, query, body, year):
+        return 200, await self.read(annual_earnings, int(year))
+
+    def _start_run(self, run_id):
+        # Запуск долгий, поэтому идёт в отдельном потоке со своим соединением, не занимая очередь записи
+        if run_id in self.active_runs:
+            raise ApiError(409, f"Запуск №{run_id} уже выполняется")
+        self.active_runs.add(run_id)
+
+        def worker():
+            try:
+                execute_payroll_run(run_id, self.db_path)
+            except PayrollRunBusy:
+                # Запуск выполняет другой процесс, его состояние видно в GET /payroll-runs/{id}
+                pass
+            finally:
+                self.active_runs.discard(run_id)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    async def create_payroll_run(self, query, body):
+        period = str(body.get("period") or "")
+        if not re.match(r"^\d{4}-(0[1-9]|1[0-2])$", period):
+            raise ApiError(400, "period - месяц в формате ГГГГ-ММ")
+        # Параметры проверяются сразу: с нечисловой суммой не посчитался бы ни один сотрудник
+        try:
+            params = {key: float(body[key] or 0) for key in get_payroll_plan().inputs
+                      if key in body and key != "base_salary"}
+        except (TypeError, ValueError):
+            raise ApiError(400, "Суммы запуска должны быть числами")
+        params["use_timesheet"] = bool(body.get("use_timesheet", True))
+        params["send_email"] = bool(body.get("send_email", False))
+        employee_ids = body.get("employee_ids")
+        if employee_ids is not None and (not isinstance(employee_ids, list) or not all(
+                isinstance(emp_id, int) and not isinstance(emp_id, bool) for emp_id in employee_ids)):
+            raise ApiError(400, "employee_ids - список целых чисел")
+        calc_date = body.get("calc_date") or period_calc_date(period)
+        if not isinstance(calc_date, str):
+            raise ApiError(400, "calc_date - строка с датой")
+        run_id = await self.write(create_payroll_run, period, calc_date, params, employee_ids)
+        self._start_run(run_id)
+        return 201, await self.read(payroll_run_summary, run_id)
+
+    async def get_payroll_run(self, query, body, run_id):
+        summary = await self.read(payroll_run_summary, int(run_id))
+        if summary is None:
+            raise ApiError(404, "Запуск не найден")
+        summary["active"] = int(run_id) in self.active_runs or summary["leased"]
+        return 200, summary
+
+    async def resume_payroll_run(self, query, body, run_id):
+        status, summary = await self.get_payroll_run(query, body, run_id)
+        if summary["status"] == "done":
+            return 200, summary
+        if summary["status"] == "cancelled":
+            raise ApiError(409, f"Запуск №{run_id} закрыт")
+        if summary["active"]:
+            raise ApiError(409, f"Запуск №{run_id} уже выполняется")
+        self._start_run(int(run_id))
+        return 202, summary
+
+    async def cancel_payroll_run(self, query, body, run_id):
+        if not await self.write(cancel_payroll_run, int(run_id)):
+            if await self.read(payroll_run_summary, int(run_id)) is None:
+                raise ApiError(404, "Запуск не найден")
+            raise ApiError(409, f"Запуск №{run_id} уже завершён")
+        return await self.get_payroll_run(query, body, run_id)
+
+    # --- HTTP ---
+
+    async def dispatch(self, method, target, headers, raw_body):
+        # Сравнение за постоянное время, чтобы токен нельзя было подобрать по времени ответа
+        if self.token and not hmac.compare_digest(headers.get("authorization", "").encode("latin-1"),
+                                                  f"Bearer {self.token}".encode("utf-8")):
+            raise ApiError(401, "Требуется авторизация")
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        path_matched = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(url.path)
+            if not match:
+                continue
+            path_matched = True
+            if route_method != method:
+                continue
+            body = {}
+            if raw_body:
+                try:
+                    body = json.loads(raw_body.decode("utf-8"))
+                except (UnicodeDecodeError, ValueError):
+                    raise ApiError(400, "Тело запроса должно быть JSON")
+                if not isinstance(body, dict):
+                    raise ApiError(400, "Тело запроса должно быть JSON-объектом")
+            return await handler(query, body, *match.groups())
+        raise ApiError(405 if path_matched else 404, "Метод не поддерживается" if path_matched else "Не найдено")
+
+    def _response(self, status, payload, keep_alive):
+        headers = [f"HTTP/1.1 {status} {self.STATUS_TEXT.get(status, '')}"]
+        if isinstance(payload, tuple):
+            data, content_type, filename = payload
+            headers.append(f"Content-Type: {content_type}")
+            disposition = "inline" if content_type.startswith("text/html") else "attachment"
+            headers.append(f"Content-Disposition: {disposition}; filename*=UTF-8''{quote(filename)}")
+        elif payload is None:
+            data = b""
+        else:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            headers.append("Content-Type: application/json; charset=utf-8")
+        headers.append(f"Content-Length: {len(data)}")
+        headers.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + data
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    writer.write(self._response(400, {"error": "Некорректный запрос"}, False))
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    writer.write(self._response(400, {"error": "Некорректный Content-Length"}, False))
+                    break
+                if length > self.MAX_BODY:
+                    writer.write(self._response(413, {"error": "Слишком большой запрос"}, False))
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, payload = await self.dispatch(method.upper(), target, headers, raw_body)
+                except ApiError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                writer.write(self._response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"Сервис расчёта зарплаты: http://{self.host}:{self.port} (база: {os.path.abspath(self.db_path)})")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.read_pool.shutdown(wait=False)
+            self.write_pool.shutdown(wait=True)
+
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = SalaryCalculatorApp(root)
-    root.mainloop()
+    parser = argparse.ArgumentParser(description="Система расчёта зарплаты")
+    parser.add_argument("--serve", action="store_true", help="запустить локальный HTTP/JSON-сервис без окна")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", default=None, help="путь к employees.db")
+    parser.add_argument("--backup", action="store_true", help="сделать резервную копию базы и выйти")
+    parser.add_argument("--token", default=os.environ.get("RASCHETNIK_TOKEN"),
+                        help="если задан, клиенты должны передавать заголовок Authorization: Bearer <token>")
+    parser.add_argument("--export-changes", metavar="ФАЙЛ", help="выгрузить изменения для другого офиса и выйти")
+    parser.add_argument("--since", type=int, default=0, help="номер изменения, после которого выгружать")
+    parser.add_argument("--import-changes", metavar="ФАЙЛ", help="загрузить файл изменений другого офиса и выйти")
+    parser.add_argument("--new-node-id", action="store_true",
+                        help="присвоить базе новый идентификатор офиса (после копирования базы из другого офиса)")
+    args = parser.parse_args()
+    if args.db:
+        DB_PATH = args.db
+
+    if args.backup:
+        info = backup_database()
+        print(f"Копия: {info['path']} ({info['size']} байт), шагов: {info['steps']}, "
+              f"макс. блокировка на шаге: {info['max_step_ms']:.2f} мс, удалено старых: {len(info['removed'])}")
+    elif args.export_changes or args.import_changes or args.new_node_id:
+        conn = connect_db()
+        init_schema(conn)
+        if args.new_node_id:
+            print(f"Новый идентификатор офиса: {reset_sync_node_id(conn)}")
+        conn.close()
+        if args.import_changes:
+            try:
+                summary = import_changeset(args.import_changes)
+            except ChangesetError as e:
+                parser.exit(1, f"{e}\n")
+            print(f"Офис {summary['node'][:8]}, изменения до №{summary['until']}: применено {summary['applied']}, "
+                  f"пропущено {summary['skipped']}, записей архива без сотрудника {len(summary['unlinked'])}")
+        if args.export_changes:
+            info = export_changeset(args.since, args.export_changes)
+            print(f"Выгружены изменения №{info['since'] + 1}-{info['until']}: сотрудников {info['employees']}, "
+                  f"записей архива {info['salary_archive']} -> {info['path']}")
+    elif args.serve:
+        try:
+            server = PayrollApiServer(args.host, args.port, token=args.token)
+        except ValueError as e:
+            parser.error(str(e))
+        server.run()
+    else:
+        root = tk.Tk()
+        app = SalaryCalculatorApp(root)
+        root.mainloop()
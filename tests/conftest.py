@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Модуль тянет ReportLab и tkcalendar; без них тесты пропускаются
+    pytest.importorskip("reportlab")
+    pytest.importorskip("tkcalendar")
+    import salary_calculator9 as app
+
+    # Своя база и рабочая папка (туда пишутся PDF), правила - по умолчанию
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "DB_PATH", str(tmp_path / "employees.db"))
+    monkeypatch.setattr(app, "_payroll_plan", app.PayrollPlan(app.DEFAULT_RULES))
+    conn = app.connect_db()
+    app.init_schema(conn)
+    conn.close()
+    return app
+
+
+@pytest.fixture
+def conn(app):
+    conn = app.connect_db()
+    yield conn
+    conn.close()
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def api_server(app):
+    servers = []
+
+    def start(**kwargs):
+        # Сервис на свободном порту в отдельном потоке со своим циклом событий
+        api = app.PayrollApiServer("127.0.0.1", 0, **kwargs)
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(api.handle_client, "127.0.0.1", 0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        servers.append((api, loop, server, thread))
+        return server.sockets[0].getsockname()[1]
+
+    yield start
+    for api, loop, server, thread in servers:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        server.close()
+        loop.close()
+        api.read_pool.shutdown(wait=True)
+        api.write_pool.shutdown(wait=True)
+
+
+def send(port, raw):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(raw)
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    head, _, body = data.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(body.decode("utf-8")) if body else None
+
+
+def request(port, method, path, body=None, headers=()):
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost", "Connection: close", f"Content-Length: {len(data)}"]
+    lines.extend(headers)
+    return send(port, ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+
+
+def test_employee_crud(api_server):
+    port = api_server()
+    status, employee = request(port, "POST", "/employees", {"fio": "Иванов", "salary": "50000", "warehouse": "A"})
+    assert status == 201
+    assert (employee["fio"], employee["salary"], employee["email_pdf"]) == ("Иванов", 50000.0, True)
+
+    status, employees = request(port, "GET", "/employees")
+    assert status == 200
+    assert [e["id"] for e in employees] == [employee["id"]]
+
+    assert request(port, "PUT", f"/employees/{employee['id']}", {"fio": "", "salary": 1})[0] == 400
+    assert request(port, "DELETE", f"/employees/{employee['id']}")[0] == 204
+    assert request(port, "GET", f"/employees/{employee['id']}")[0] == 404
+
+
+def test_keep_alive_serves_several_requests(api_server):
+    port = api_server()
+    raw = (b"GET /rules HTTP/1.1\r\nHost: localhost\r\n\r\n"
+           b"GET /nowhere HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(raw)
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    assert data.count(b"HTTP/1.1 200 OK") == 1
+    assert data.count(b"HTTP/1.1 404 Not Found") == 1
+
+
+@pytest.mark.parametrize("raw, status", [
+    (b"GET\r\n\r\n", 400),
+    (b"GET /employees HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+    (b"POST /employees HTTP/1.1\r\nContent-Length: -5\r\n\r\n", 400),
+    (b"POST /employees HTTP/1.1\r\nContent-Length: 99999999\r\n\r\n", 413),
+    (b"POST /employees HTTP/1.1\r\nConnection: close\r\nContent-Length: 5\r\n\r\nnope!", 400),
+    (b"POST /employees HTTP/1.1\r\nConnection: close\r\nContent-Length: 2\r\n\r\n[]", 400),
+    (b"GET /nowhere HTTP/1.1\r\nConnection: close\r\n\r\n", 404),
+    (b"PATCH /employees HTTP/1.1\r\nConnection: close\r\n\r\n", 405),
+])
+def test_malformed_requests(api_server, raw, status):
+    port = api_server()
+    assert send(port, raw)[0] == status
+
+
+def test_token_is_required(api_server):
+    port = api_server(token="секрет")
+    assert request(port, "GET", "/employees")[0] == 401
+    assert request(port, "GET", "/employees", headers=["Authorization: Bearer wrong"])[0] == 401
+    header = "Authorization: Bearer секрет".encode("utf-8").decode("latin-1")
+    assert request(port, "GET", "/employees", headers=[header]) == (200, [])
+
+
+def test_network_host_needs_token(app):
+    assert app.is_loopback_host("localhost")
+    assert app.is_loopback_host("127.0.0.1")
+    assert app.is_loopback_host("::1")
+    assert not app.is_loopback_host("0.0.0.0")
+    with pytest.raises(ValueError):
+        app.PayrollApiServer("0.0.0.0", 0)
+    api = app.PayrollApiServer("0.0.0.0", 0, token="секрет")
+    api.read_pool.shutdown()
+    api.write_pool.shutdown()
+
+
+@pytest.mark.parametrize("body", [
+    {"period": "2026-13"},
+    {"period": "2026-10", "fixed_bonus": "abc"},
+    {"period": "2026-10", "fixed_bonus": [1]},
+    {"period": "2026-10", "employee_ids": 5},
+    {"period": "2026-10", "employee_ids": ["1"]},
+    {"period": "2026-10", "calc_date": 31},
+])
+def test_payroll_run_params_are_checked(api_server, body):
+    port = api_server()
+    assert request(port, "POST", "/payroll-runs", body)[0] == 400
+
+
+def test_payroll_run_via_api(app, conn, api_server):
+    port = api_server()
+    emp_id = app.insert_employee(conn, "Иванов", "кладовщик", "", "A", 50000)
+    status, summary = request(port, "POST", "/payroll-runs", {"period": "2026-10", "fixed_bonus": "1000",
+                                                               "employee_ids": [emp_id]})
+    assert status == 201
+    assert summary["params"]["fixed_bonus"] == 1000.0
+    for _ in range(100):
+        status, summary = request(port, "GET", f"/payroll-runs/{summary['id']}")
+        if summary["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert summary["status"] == "done"
+    assert conn.execute("SELECT period, fixed_bonus FROM salary_archive").fetchall() == [("2026-10", 1000.0)]
+
+
+def test_payroll_run_cancel(app, conn, api_server):
+    port = api_server()
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {})
+    assert request(port, "POST", "/payroll-runs/999/cancel")[0] == 404
+    status, summary = request(port, "POST", f"/payroll-runs/{run_id}/cancel")
+    assert (status, summary["status"]) == (200, "cancelled")
+    assert request(port, "POST", f"/payroll-runs/{run_id}/cancel")[0] == 409
+    assert request(port, "POST", f"/payroll-runs/{run_id}/resume")[0] == 409
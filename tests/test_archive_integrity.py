@@ -0,0 +1,57 @@
+import os
+
+
+def add_records(app, conn, count):
+    emp_id = app.insert_employee(conn, "Петров", "кладовщик", "", "A", 1000)
+    values = app.get_payroll_plan().evaluate({"base_salary": 1000}, 1000)
+    os.makedirs("pdf", exist_ok=True)
+    ids = []
+    for i in range(count):
+        path = os.path.join("pdf", f"r{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4\n" + bytes([i]) * 2000 + b"\n%%EOF\n")
+        ids.append(app.insert_archive_record(conn, emp_id, "Петров", "кладовщик", "A", values, values["total"],
+                                             "31.10.2026", path))
+    return ids
+
+
+def problems(app, conn):
+    return dict(app.fetch_pdf_problems(conn))
+
+
+def test_missing_and_corrupt_files_are_flagged(app, conn):
+    ids = add_records(app, conn, 4)
+    assert app.scan_archive_integrity()["ok"] == 4
+
+    os.remove("pdf/r0.pdf")
+    with open("pdf/r1.pdf", "r+b") as f:
+        f.seek(100)
+        f.write(b"XXXX")
+    with open("pdf/r2.pdf", "r+b") as f:
+        f.truncate(50)
+
+    summary = app.scan_archive_integrity()
+    assert (summary["ok"], summary["missing"], summary["corrupt"]) == (1, 1, 2)
+    assert problems(app, conn) == {ids[0]: "missing", ids[1]: "corrupt", ids[2]: "corrupt"}
+
+    app.rerender_archive_pdfs(list(problems(app, conn)))
+    assert app.scan_archive_integrity()["ok"] == 4
+    assert problems(app, conn) == {}
+
+
+def test_unreadable_file_does_not_abort_scan(app, conn, monkeypatch):
+    ids = add_records(app, conn, 3)
+    hash_pdf = app.hash_pdf
+
+    def flaky(path):
+        # r0 удалён между чтением каталога и хэшированием, r1 не читается
+        if path.endswith("r0.pdf"):
+            os.remove(path)
+        if path.endswith(("r0.pdf", "r1.pdf")):
+            raise OSError("нет доступа")
+        return hash_pdf(path)
+
+    monkeypatch.setattr(app, "hash_pdf", flaky)
+    summary = app.scan_archive_integrity()
+    assert (summary["ok"], summary["missing"], summary["corrupt"], summary["files"]) == (1, 1, 1, 1)
+    assert problems(app, conn) == {ids[0]: "missing", ids[1]: "corrupt"}
@@ -0,0 +1,49 @@
+import os
+import time
+
+
+def test_backup_and_restore_round_trip(app, conn, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    emp_id = app.insert_employee(conn, "Иванов", "кладовщик", "", "A", 50000)
+    info = app.backup_database(backup_dir, pages=1, pause=0)
+    assert info["steps"] > 1
+    assert app.check_database_integrity(info["path"])
+    assert app.list_backups(backup_dir) == [info["path"]]
+
+    app.update_employee(conn, emp_id, "Иванов И.", "кладовщик", "", "A", 60000)
+    app.insert_employee(conn, "Петров", "водитель", "", "B", 40000)
+    conn.close()
+
+    safety_path = app.restore_database(info["path"])
+    conn = app.connect_db()
+    try:
+        assert conn.execute("SELECT fio, salary FROM employees").fetchall() == [("Иванов", 50000)]
+    finally:
+        conn.close()
+
+    # Состояние перед восстановлением сохранено отдельно и в список плановых копий не попадает
+    assert os.path.basename(safety_path).startswith("before_restore_")
+    safety = app.connect_db(safety_path)
+    try:
+        assert safety.execute("SELECT count(*) FROM employees").fetchone()[0] == 2
+    finally:
+        safety.close()
+
+
+def test_rotation_keeps_newest_and_ignores_safety_copies(app, tmp_path):
+    backup_dir = tmp_path / "backups"
+    backup_dir.mkdir()
+    names = [f"employees_202610{day:02d}_030000.db" for day in range(1, 6)]
+    safety = ["before_restore_20261001_120000.db", "employees_20261001_120000_before_restore.db", "notes.db"]
+    for name in names + safety:
+        (backup_dir / name).write_bytes(b"")
+
+    removed = app.rotate_backups(str(backup_dir), keep=2)
+    assert sorted(os.path.basename(p) for p in removed) == names[:3]
+    assert sorted(os.listdir(backup_dir)) == sorted(names[3:] + safety)
+
+    # Свежая копия перед восстановлением не отменяет плановую
+    old = time.time() - 2 * 24 * 3600
+    for name in names[3:]:
+        os.utime(backup_dir / name, (old, old))
+    assert app.backup_is_due(str(backup_dir))
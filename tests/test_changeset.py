@@ -0,0 +1,188 @@
+import pytest
+
+
+@pytest.fixture
+def office_b(app, tmp_path):
+    path = str(tmp_path / "office_b.db")
+    conn = app.connect_db(path)
+    app.init_schema(conn)
+    conn.close()
+    return path
+
+
+def exchange(app, source, target, since, path):
+    app.export_changeset(since, path, source)
+    return app.import_changeset(path, target)
+
+
+def rows(app, db_path, sql):
+    conn = app.connect_db(db_path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_round_trip(app, conn, office_b, tmp_path):
+    office_a = app.DB_PATH
+    emp_id = app.insert_employee(conn, "Иванов", "кладовщик", "i@example.com", "A", 50000)
+    app.update_employee(conn, emp_id, "Иванов И.", "кладовщик", "i@example.com", "A", 55000)
+    values = app.get_payroll_plan().evaluate({"base_salary": 55000, "overtime": 10}, 55000)
+    record_id = app.insert_archive_record(conn, emp_id, "Иванов И.", "кладовщик", "A", values, values["total"],
+                                          "31.10.2026", "x.pdf")
+
+    # Две правки сотрудника сжимаются в одну запись
+    info = app.export_changeset(0, str(tmp_path / "a1.json.gz"), office_a)
+    assert (info["employees"], info["salary_archive"]) == (1, 1)
+    summary = app.import_changeset(info["path"], office_b)
+    assert (summary["applied"], summary["skipped"]) == (2, 0)
+
+    employees = rows(app, office_b, "SELECT id, uid, fio, salary FROM employees")
+    assert [(fio, salary) for _, _, fio, salary in employees] == [("Иванов И.", 55000.0)]
+    b_emp_id = employees[0][0]
+    archive = rows(app, office_b, "SELECT id, employee_id, total, period FROM salary_archive")
+    assert archive == [(archive[0][0], b_emp_id, values["total"], "2026-10")]
+    assert len(rows(app, office_b, "SELECT * FROM salary_archive_component")) == len(app.LEGACY_FIELDS)
+
+    # Повторная загрузка того же файла ничего не меняет
+    summary = app.import_changeset(info["path"], office_b)
+    assert (summary["applied"], summary["skipped"]) == (0, 2)
+    assert len(rows(app, office_b, "SELECT * FROM employees")) == 1
+
+    # Удаление в офисе A доходит до B
+    since = app.last_change_seq(conn)
+    app.delete_archive_record(conn, record_id)
+    app.delete_employee_row(conn, emp_id)
+    summary = exchange(app, office_a, office_b, since, str(tmp_path / "a2.json.gz"))
+    assert summary["applied"] == 2
+    assert rows(app, office_b, "SELECT * FROM employees") == []
+    assert rows(app, office_b, "SELECT * FROM salary_archive") == []
+    assert rows(app, office_b, "SELECT * FROM salary_archive_component") == []
+
+
+def test_own_changes_are_not_echoed_back(app, conn, office_b, tmp_path):
+    office_a = app.DB_PATH
+    app.insert_employee(conn, "Петров", "", "", "A", 1000)
+    app.insert_employee(conn, "Смирнов", "", "", "A", 1000)
+    exchange(app, office_a, office_b, 0, str(tmp_path / "a.json.gz"))
+
+    b = app.connect_db(office_b)
+    b_emp_id = b.execute("SELECT id FROM employees WHERE fio = 'Петров'").fetchone()[0]
+    app.update_employee(b, b_emp_id, "Петров П.", "", "", "A", 2000)
+    b.close()
+
+    summary = exchange(app, office_b, office_a, 0, str(tmp_path / "b.json.gz"))
+    # Смирнов пришёл из A и не менялся - пропускается, правка из B применяется
+    assert (summary["applied"], summary["skipped"]) == (1, 1)
+    assert rows(app, office_a, "SELECT fio, salary FROM employees ORDER BY id") == [("Петров П.", 2000.0),
+                                                                                     ("Смирнов", 1000.0)]
+
+
+def test_gap_and_own_file_are_refused(app, conn, office_b, tmp_path):
+    office_a = app.DB_PATH
+    app.insert_employee(conn, "Сидоров", "", "", "A", 1000)
+    since = app.last_change_seq(conn)
+    app.insert_employee(conn, "Кузнецов", "", "", "A", 1000)
+
+    with pytest.raises(app.ChangesetError, match="Пропущены изменения"):
+        exchange(app, office_a, office_b, since, str(tmp_path / "gap.json.gz"))
+    with pytest.raises(app.ChangesetError, match="этой же базы"):
+        exchange(app, office_a, office_a, 0, str(tmp_path / "own.json.gz"))
+    assert rows(app, office_b, "SELECT * FROM employees") == []
+
+
+def test_copied_database_gets_new_node_id(app, conn, tmp_path):
+    app.insert_employee(conn, "Общий", "", "", "A", 1000)
+    conn.commit()
+    copy_path = str(tmp_path / "copy.db")
+    copy = app.connect_db(copy_path)
+    conn.backup(copy)
+    old_node = app.sync_node_id(copy)
+    assert app.reset_sync_node_id(copy) != old_node
+    app.insert_employee(copy, "Новый", "", "", "B", 1000)
+    copy.close()
+
+    # Общая строка уже есть в A и приходит как её же изменение - пропускается
+    summary = exchange(app, copy_path, app.DB_PATH, 0, str(tmp_path / "copy.json.gz"))
+    assert (summary["applied"], summary["skipped"]) == (1, 1)
+    assert sorted(fio for fio, in rows(app, app.DB_PATH, "SELECT fio FROM employees")) == ["Новый", "Общий"]
+
+
+def test_restore_makes_a_new_node(app, conn, office_b, tmp_path):
+    office_a = app.DB_PATH
+    app.insert_employee(conn, "Икс", "", "", "A", 1000)
+    backup = app.backup_database(str(tmp_path / "backups"), pause=0)
+    app.insert_employee(conn, "Игрек", "", "", "A", 1000)
+    old_node = app.sync_node_id(conn)
+    exchange(app, office_a, office_b, 0, str(tmp_path / "a1.json.gz"))
+    conn.close()
+
+    # После восстановления журнал снова короче, но новые номера не совпадают с уже принятыми в B
+    app.restore_database(backup["path"])
+    conn = app.connect_db()
+    try:
+        assert app.sync_node_id(conn) != old_node
+        app.insert_employee(conn, "Зет", "", "", "A", 1000)
+    finally:
+        conn.close()
+
+    with pytest.raises(app.ChangesetError, match="Пропущены изменения"):
+        exchange(app, office_a, office_b, 2, str(tmp_path / "a2.json.gz"))
+    summary = exchange(app, office_a, office_b, 0, str(tmp_path / "a3.json.gz"))
+    assert (summary["applied"], summary["skipped"]) == (2, 0)
+    assert "Зет" in [fio for fio, in rows(app, office_b, "SELECT fio FROM employees")]
+
+
+def test_rows_from_before_the_journal_are_exported(app, office_b, tmp_path):
+    # База в формате до журнала изменений: без uid, change_log и компонентов архива
+    old_path = str(tmp_path / "old.db")
+    old = app.sqlite3.connect(old_path)
+    old.executescript('''
+        CREATE TABLE employees (id INTEGER PRIMARY KEY AUTOINCREMENT, fio TEXT NOT NULL, position TEXT,
+                                email TEXT, warehouse TEXT, salary REAL);
+        CREATE TABLE salary_archive (id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER, fio TEXT,
+                                     position TEXT, warehouse TEXT, base_salary REAL, fixed_bonus REAL,
+                                     feoktistov_bonus REAL, overtime REAL, deduction_defect REAL,
+                                     deduction_absent REAL, total REAL, calc_date TEXT, pdf_path TEXT,
+                                     FOREIGN KEY (employee_id) REFERENCES employees (id));
+        INSERT INTO employees (fio, position, email, warehouse, salary) VALUES ('Старый', '', '', 'A', 30000);
+        INSERT INTO salary_archive (employee_id, fio, position, warehouse, base_salary, fixed_bonus,
+                                    feoktistov_bonus, overtime, deduction_defect, deduction_absent, total,
+                                    calc_date, pdf_path)
+        VALUES (1, 'Старый', '', 'A', 30000, 1000, 0, 0, 0, 0, 31000, '30.09.2026 10:00', 'old.pdf');
+    ''')
+    old.commit()
+    old.close()
+    for _ in range(2):
+        conn = app.connect_db(old_path)
+        app.init_schema(conn)
+        conn.close()
+
+    summary = exchange(app, old_path, office_b, 0, str(tmp_path / "old.json.gz"))
+    assert (summary["applied"], summary["unlinked"]) == (2, [])
+    assert rows(app, office_b, '''
+        SELECT e.fio, a.total, a.period FROM salary_archive a JOIN employees e ON e.id = a.employee_id
+    ''') == [("Старый", 31000.0, "2026-09")]
+    # Повторный запуск программы журнал не дублирует
+    conn = app.connect_db(old_path)
+    try:
+        assert app.last_change_seq(conn) == 2
+    finally:
+        conn.close()
+
+
+def test_archive_without_known_employee_is_reported(app, conn, office_b):
+    emp_id = app.insert_employee(conn, "Иванов", "", "", "A", 1000)
+    values = app.get_payroll_plan().evaluate({"base_salary": 1000}, 1000)
+    app.insert_archive_record(conn, emp_id, "Иванов", "", "A", values, values["total"], "31.10.2026", "x.pdf")
+    changeset = app.build_changeset(conn)
+    archive_uid = changeset["salary_archive"][0][3]
+    changeset["employees"] = []
+
+    b = app.connect_db(office_b)
+    try:
+        summary = app.apply_changeset(b, changeset)
+        assert summary["unlinked"] == [archive_uid]
+        assert b.execute("SELECT employee_id FROM salary_archive").fetchall() == [(None,)]
+    finally:
+        b.close()
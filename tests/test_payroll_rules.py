@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+EXAMPLE_RULES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "payroll_rules.example.json")
+
+
+def plan_with(app, *components):
+    return app.PayrollPlan({"components": list(components)})
+
+
+@pytest.mark.parametrize("components, message", [
+    ([{"key": "a", "formula": "b"}, {"key": "b", "formula": "a"}], "Циклическая зависимость"),
+    ([{"key": "a", "kind": "accrual", "formula": "accruals * 2"}], "Циклическая зависимость"),
+    ([{"key": "a", "formula": "a + 1"}], "Циклическая зависимость"),
+    ([{"key": "a", "formula": "zzz + 1"}], "неизвестные имена"),
+    ([{"key": "a", "formula": "open"}], "неизвестные имена"),
+    ([{"key": "a", "formula": "__import__('os')"}], "только min, max, round, abs"),
+    ([{"key": "a", "formula": "salary.real"}], "Attribute"),
+    ([{"key": "a", "formula": "().__class__"}], "Attribute"),
+    ([{"key": "a", "formula": "(lambda: 1)()"}], "только min, max, round, abs"),
+    ([{"key": "a", "formula": "lambda: 1"}], "Lambda"),
+    ([{"key": "a", "formula": "[x for x in (1, 2)][0]"}], "недопустима"),
+    ([{"key": "a", "formula": "'s'"}], "только числа"),
+    ([{"key": "a", "formula": "1 +"}], "ошибка в формуле"),
+    ([{"key": "A"}], "ключ должен"),
+    ([{"key": "a"}, {"key": "a"}], "ключ занят"),
+    ([{"key": "salary"}], "ключ занят"),
+])
+def test_invalid_rules_are_rejected(app, components, message):
+    with pytest.raises(app.PayrollRulesError, match=message):
+        plan_with(app, *components)
+
+
+def test_default_rules_total(app):
+    plan = app.PayrollPlan(app.DEFAULT_RULES)
+    values = plan.evaluate({"base_salary": 30000, "fixed_bonus": "1000", "overtime": 500,
+                            "deduction_defect": 200, "deduction_absent": 300}, 30000)
+    assert values["total"] == 31000.0
+    assert [label for label, sign, amount in plan.lines(values)][0] == "Окладная ставка"
+
+
+def test_example_rules_totals(app):
+    plan = app.load_payroll_plan(EXAMPLE_RULES)
+    values = plan.evaluate({"base_salary": 50000, "night_shift": 3000, "deduction_absent": 2000,
+                            "advance": 20000}, 50000)
+    # НДФЛ 13% от начислений за вычетом дней Б/С: round((53000 - 2000) * 0.13)
+    assert values["ndfl"] == 6630.0
+    assert values["total"] == 24370.0
+    assert "ndfl" not in plan.inputs
+
+
+def test_batch_matches_single_evaluation(app):
+    plan = app.load_payroll_plan(EXAMPLE_RULES)
+    rows = [({"base_salary": 1000 * i, "night_shift": i, "advance": 100}, 1000 * i) for i in range(50)]
+    assert plan.evaluate_batch(rows) == [plan.evaluate(values, salary) for values, salary in rows]
+
+
+def test_allowed_functions(app):
+    plan = plan_with(app, {"key": "base_salary", "kind": "accrual"},
+                     {"key": "bonus", "kind": "accrual", "formula": "max(base_salary * 0.1, 500)"},
+                     {"key": "fee", "kind": "deduction", "formula": "round(abs(-bonus) / 3, 2)"})
+    values = plan.evaluate({"base_salary": 1000}, 0)
+    assert values["bonus"] == 500.0
+    assert values["fee"] == 166.67
+    assert values["total"] == pytest.approx(1333.33)
+
+
+def archive_with(app, conn, plan, monkeypatch, inputs):
+    monkeypatch.setattr(app, "_payroll_plan", plan)
+    for warehouse, values in inputs:
+        values = plan.evaluate(values, values.get("base_salary", 0))
+        app.insert_archive_record(conn, None, "Иванов", "кладовщик", warehouse, values, values["total"],
+                                  "15.10.2026", "x.pdf")
+    return app.load_archive_columns(conn, 1, today=app.datetime(2026, 10, 31))
+
+
+def test_simulation_uses_formulas(app, conn, monkeypatch):
+    plan = app.load_payroll_plan(EXAMPLE_RULES)
+    columns = archive_with(app, conn, plan, monkeypatch, [
+        ("A", {"base_salary": 50000, "fixed_bonus": 10000}),
+        ("A", {"base_salary": 40000, "fixed_bonus": 10000, "advance": 5000}),
+        ("B", {"base_salary": 30000, "overtime": 2000}),
+    ])
+    result = app.simulate_scenarios(columns, [{"name": "x2", "fixed_bonus_factor": 2, "overtime_factor": 1.5}])["x2"]
+
+    # Двойная премия 10000 с НДФЛ 13% увеличивает итог на 8700, а не на 10000
+    assert result["A"]["delta"] == pytest.approx(2 * 8700)
+    assert result["B"]["delta"] == pytest.approx(870)
+    assert result["A"]["current"] == pytest.approx((60000 - 7800) + (50000 - 6500 - 5000))
+    expected = plan.evaluate({"base_salary": 50000, "fixed_bonus": 20000}, 50000)["total"]
+    before = plan.evaluate({"base_salary": 50000, "fixed_bonus": 10000}, 50000)["total"]
+    assert expected - before == pytest.approx(8700)
+
+
+def test_simulation_without_formulas_uses_sums(app, conn, monkeypatch):
+    plan = plan_with(app, {"key": "base_salary"}, {"key": "fixed_bonus"},
+                     {"key": "overtime", "kind": "deduction"})
+    assert plan.linear
+    columns = archive_with(app, conn, plan, monkeypatch, [("A", {"base_salary": 1000, "fixed_bonus": 100,
+                                                                 "overtime": 10})])
+    result = app.simulate_scenarios(columns, [{"name": "s", "fixed_bonus_amount": 300, "overtime_factor": 2,
+                                                "feoktistov_bonus_factor": 5}])["s"]
+    # feoktistov_bonus нет в правилах, overtime здесь вычет
+    assert result["A"]["delta"] == pytest.approx(200 - 10)
+    assert not app.load_payroll_plan(EXAMPLE_RULES).linear
@@ -0,0 +1,134 @@
+import threading
+
+import pytest
+
+
+def add_employees(app, conn, count):
+    return [app.insert_employee(conn, f"Сотрудник {i}", "кладовщик", "", "A", 30000 + i) for i in range(count)]
+
+
+def archive_counts(conn):
+    return dict(conn.execute("SELECT employee_id, count(*) FROM salary_archive GROUP BY employee_id").fetchall())
+
+
+def test_archive_period_comes_from_run(app, conn):
+    emp_id, = add_employees(app, conn, 1)
+    app.set_absent_mask(conn, emp_id, "2026-09", app.days_to_mask([1, 2]))
+    # Дата расчёта - уже следующий месяц, а в архив запись должна попасть за сентябрь
+    run_id = app.create_payroll_run(conn, "2026-09", "19.10.2026", {})
+    summary = app.execute_payroll_run(run_id)
+
+    assert summary["status"] == "done"
+    period, deduction = conn.execute("SELECT period, deduction_absent FROM salary_archive").fetchone()
+    assert period == "2026-09"
+    assert deduction > 0
+    assert app.period_calc_date("2026-09") == "30.09.2026"
+    assert app.period_calc_date("2024-02") == "29.02.2024"
+
+
+def test_resume_after_stop_archives_each_employee_once(app, conn):
+    ids = add_employees(app, conn, 6)
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {"fixed_bonus": 1000})
+    stop = threading.Event()
+
+    def progress(done, total):
+        if done == 3:
+            stop.set()
+
+    summary = app.execute_payroll_run(run_id, progress=progress, stop=stop)
+    assert summary["status"] == "running"
+    assert app.find_unfinished_payroll_run(conn) == run_id
+
+    summary = app.execute_payroll_run(run_id)
+    assert summary["status"] == "done"
+    assert summary["steps"]["archived"] == len(ids)
+    assert archive_counts(conn) == {emp_id: 1 for emp_id in ids}
+    assert app.find_unfinished_payroll_run(conn) is None
+    # Повторный запуск завершённого ничего не добавляет
+    app.execute_payroll_run(run_id)
+    assert archive_counts(conn) == {emp_id: 1 for emp_id in ids}
+
+
+def test_second_runner_is_refused_while_lease_is_held(app, conn):
+    ids = add_employees(app, conn, 4)
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {})
+    refused = []
+
+    def progress(done, total):
+        if done == 1:
+            try:
+                app.execute_payroll_run(run_id)
+            except app.PayrollRunBusy:
+                refused.append(done)
+
+    summary = app.execute_payroll_run(run_id, progress=progress)
+    assert refused == [1]
+    assert summary["status"] == "done"
+    assert summary["leased"] is False
+    assert archive_counts(conn) == {emp_id: 1 for emp_id in ids}
+
+
+def test_overlapping_runners_do_not_archive_twice(app, conn, monkeypatch):
+    # Аренда истекает сразу - защищают только условные переходы между шагами
+    monkeypatch.setattr(app, "PAYROLL_LEASE_SECONDS", -1)
+    ids = add_employees(app, conn, 5)
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {})
+
+    def progress(done, total):
+        if done == 1:
+            app.execute_payroll_run(run_id)
+
+    summary = app.execute_payroll_run(run_id, progress=progress)
+    assert summary["status"] == "done"
+    assert summary["errors"] == []
+    assert archive_counts(conn) == {emp_id: 1 for emp_id in ids}
+
+
+def test_deleted_employee_does_not_block_run(app, conn):
+    ids = add_employees(app, conn, 3)
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {})
+    app.delete_employee_row(conn, ids[1])
+
+    summary = app.execute_payroll_run(run_id)
+    assert summary["status"] == "done"
+    assert summary["steps"]["skipped"] == 1
+    assert summary["errors"] == [{"employee_id": ids[1], "step": "skipped", "error": "Сотрудник удалён"}]
+    assert app.find_unfinished_payroll_run(conn) is None
+
+
+def test_unknown_run(app):
+    with pytest.raises(ValueError):
+        app.execute_payroll_run(12345)
+
+
+def test_run_that_cannot_finish_can_be_cancelled(app, conn):
+    add_employees(app, conn, 2)
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {"fixed_bonus": "abc"})
+    summary = app.execute_payroll_run(run_id)
+    assert summary["status"] == "running"
+    assert len(summary["errors"]) == 2
+
+    assert app.cancel_payroll_run(conn, run_id)
+    assert not app.cancel_payroll_run(conn, run_id)
+    assert app.find_unfinished_payroll_run(conn) is None
+    summary = app.execute_payroll_run(run_id)
+    assert summary["status"] == "cancelled"
+    assert summary["steps"]["pending"] == 2
+
+
+def test_cancel_stops_active_runner(app, conn):
+    add_employees(app, conn, 5)
+    run_id = app.create_payroll_run(conn, "2026-10", app.period_calc_date("2026-10"), {})
+
+    def progress(done, total):
+        if done == 2:
+            app.cancel_payroll_run(conn, run_id)
+
+    summary = app.execute_payroll_run(run_id, progress=progress)
+    assert summary["status"] == "cancelled"
+    assert summary["steps"]["archived"] == 2
+    assert summary["leased"] is False
+    # Завершённый запуск не отменяется
+    done_id = app.create_payroll_run(conn, "2026-11", app.period_calc_date("2026-11"), {})
+    app.execute_payroll_run(done_id)
+    assert not app.cancel_payroll_run(conn, done_id)
@@ -0,0 +1,33 @@
+import pytest
+
+
+LINES = [("Оклад", 1, 30000.0), ("Недостача", -1, 0.0), ("Б/С", -1, 1500.5), ("Округление", -1, -0.001)]
+
+
+@pytest.mark.parametrize("sign, amount, text", [
+    (1, 30000, "30 000.00"),
+    (-1, 1500.5, "-1 500.50"),
+    (-1, 0.0, "0.00"),
+    (-1, -0.0, "0.00"),
+    (-1, 0.001, "0.00"),
+    (1, -0.001, "0.00"),
+])
+def test_line_amount_sign(app, sign, amount, text):
+    assert app.format_line_amount(sign, amount) == text
+
+
+def test_text_and_html_use_same_amounts(app):
+    text = app.render_payslip_text("Иванов", "кладовщик", "A", 1, "31.10.2026", LINES, 28499.5)
+    page = app.render_payslip_html("Иванов", "кладовщик", "A", 1, "31.10.2026", LINES, 28499.5)
+    for label, sign, amount in LINES:
+        assert app.format_line_amount(sign, amount) in text
+        assert label in page
+    assert "-0.00" not in text and "-0.00" not in page
+    assert "28 499.50" in text and "28 499.50" in page
+
+
+def test_missing_fields_are_blank(app):
+    text = app.render_payslip_text(None, None, None, 1, None, LINES, 0)
+    page = app.render_payslip_html(None, None, None, 1, None, LINES, 0)
+    assert "None" not in text
+    assert "None" not in page
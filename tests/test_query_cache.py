@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def cache(app):
+    cache = app.QueryCache()
+    yield cache
+    cache.close()
+
+
+def test_commit_on_other_connection_invalidates(app, conn, cache):
+    app.insert_employee(conn, "Иванов", "кладовщик", "", "A", 50000)
+    first = app.fetch_employees(cache)
+    assert app.fetch_employees(cache) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Запись через другое соединение: следующий запрос идёт в базу и видит новую строку
+    app.insert_employee(conn, "Петров", "водитель", "", "B", 40000)
+    rows = app.fetch_employees(cache)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert [row[1] for row in rows] == ["Иванов", "Петров"]
+    assert app.fetch_employees(cache) == rows
+    assert cache.hits == 2
+
+
+def test_uncommitted_write_keeps_cache(app, conn, cache):
+    app.insert_employee(conn, "Иванов", "кладовщик", "", "A", 50000)
+    app.fetch_employees(cache)
+    conn.execute("UPDATE employees SET salary = 1")
+    assert app.fetch_employees(cache)[0][5] == 50000
+    assert cache.hits == 1
+    conn.rollback()
+
+
+def test_only_reads_are_cached(cache):
+    with pytest.raises(ValueError):
+        cache.execute("DELETE FROM employees")